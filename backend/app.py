@@ -1,94 +1,271 @@
 from flask import Flask, request, jsonify, send_file
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
+from openpyxl import Workbook
 import openai
-import json
-import pandas as pd
+import requests
+import orjson
 import io
+import gzip
+import hashlib
 import os
+import tempfile
 from datetime import datetime
 import uuid
-from langchain.llms import OpenAI
-from langchain.prompts import PromptTemplate
-from langchain.chains import LLMChain
 import tiktoken
 from dotenv import load_dotenv
 import random
+import re
+import atexit
+import logging
 import sqlite3
+import threading
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import repeat
 from contextlib import contextmanager
+from functools import lru_cache
+from tenacity import retry, stop_after_attempt, wait_random_exponential, retry_if_exception_type, before_sleep_log
 
 # Load environment variables from .env file
 load_dotenv()
 
+# Per-replica progress is logged at DEBUG, so it costs nothing at the default INFO level
+logging.basicConfig(
+    level=os.getenv('LOG_LEVEL', 'INFO').upper(),
+    format='%(asctime)s %(levelname)s %(name)s: %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+class ORJSONProvider(JSONProvider):
+    """Flask JSON provider backed by orjson for request parsing and jsonify"""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 app = Flask(__name__)
-CORS(app)
+app.json = ORJSONProvider(app)
+
+# Restrict CORS to the API routes and let browsers cache preflight responses
+CORS(
+    app,
+    resources={r"/api/*": {"origins": os.getenv('CORS_ORIGINS', '*').split(',')}},
+    max_age=86400
+)
 
 # Database setup for persistent token tracking
 DB_FILE = 'token_tracking.db'
 
+# A small pool of open connections reused across requests. A thread-local cache doesn't work
+# under gevent workers, where threading.local is per greenlet and every request would open
+# (and leak) a fresh connection. Pooled connections are handed from thread to thread, one
+# borrower at a time, hence check_same_thread=False
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '4'))
+_db_pool = queue.LifoQueue(maxsize=DB_POOL_SIZE)
+
+def _open_db_connection():
+    """Open and configure a new database connection"""
+    conn = sqlite3.connect(DB_FILE, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.executescript('''
+        PRAGMA journal_mode=WAL;
+        PRAGMA synchronous=NORMAL;
+        PRAGMA temp_store=memory;
+        PRAGMA cache_size=-64000;
+    ''')
+    return conn
+
 @contextmanager
 def get_db_connection():
-    """Context manager for database connections"""
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
+    """Context manager lending a pooled database connection"""
+    try:
+        conn = _db_pool.get_nowait()
+    except queue.Empty:
+        conn = _open_db_connection()
     try:
         yield conn
     finally:
-        conn.close()
+        # Never hand an unfinished transaction to the next borrower
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            _db_pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+def close_db_connections():
+    """Close every idle pooled connection"""
+    while True:
+        try:
+            _db_pool.get_nowait().close()
+        except queue.Empty:
+            return
+
+# Registered before the token flush below, so it runs after it at exit
+atexit.register(close_db_connections)
+
+DEFAULT_SESSION_ID = 'main'
 
 def init_database():
-    """Initialize the database with token tracking table"""
+    """Initialize the database with the token tracking and response cache tables"""
     with get_db_connection() as conn:
         cursor = conn.cursor()
+        # Take the write lock up front so concurrently starting workers
+        # initialize (and migrate) the schema one at a time
+        cursor.execute('BEGIN IMMEDIATE')
+        columns = [row[1] for row in cursor.execute('PRAGMA table_info(token_usage)')]
+        if 'id' in columns:
+            # Migrate the old AUTOINCREMENT layout to session_id as primary key
+            cursor.execute('ALTER TABLE token_usage RENAME TO token_usage_old')
+        
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS token_usage (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                session_id TEXT UNIQUE DEFAULT 'main',
+                session_id TEXT PRIMARY KEY,
                 session_tokens INTEGER DEFAULT 0,
                 total_tokens INTEGER DEFAULT 0,
                 last_updated DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
+            ) WITHOUT ROWID
         ''')
         
-        # Insert default session if it doesn't exist
         cursor.execute('''
-            INSERT OR IGNORE INTO token_usage (session_id, session_tokens, total_tokens)
-            VALUES ('main', 0, 0)
+            CREATE TABLE IF NOT EXISTS response_cache (
+                cache_key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL
+            ) WITHOUT ROWID
         ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_response_cache_created_at ON response_cache (created_at)')
+        
+        if 'id' in columns:
+            cursor.execute('''
+                INSERT INTO token_usage (session_id, session_tokens, total_tokens, last_updated)
+                SELECT session_id, session_tokens, total_tokens, last_updated FROM token_usage_old
+            ''')
+            cursor.execute('DROP TABLE token_usage_old')
         conn.commit()
 
-def get_token_usage():
-    """Get current token usage from database"""
+# Token increments are buffered in memory and written to the database
+# periodically instead of on every request
+TOKEN_FLUSH_INTERVAL = float(os.getenv('TOKEN_FLUSH_INTERVAL', '5'))
+_pending_tokens = {}  # session_id -> [session_tokens, total_tokens]
+_pending_lock = threading.Lock()
+_flush_timer = None
+
+def _write_pending_tokens(conn):
+    """Upsert buffered token increments in one statement (caller holds _pending_lock)"""
+    if not _pending_tokens:
+        return
+    cursor = conn.cursor()
+    cursor.executemany('''
+        INSERT INTO token_usage (session_id, session_tokens, total_tokens)
+        VALUES (?, ?, ?)
+        ON CONFLICT(session_id) DO UPDATE SET
+            session_tokens = session_tokens + excluded.session_tokens,
+            total_tokens = total_tokens + excluded.total_tokens,
+            last_updated = CURRENT_TIMESTAMP
+    ''', [(session_id, pending[0], pending[1]) for session_id, pending in _pending_tokens.items()])
+    conn.commit()
+    _pending_tokens.clear()
+
+def flush_token_usage():
+    """Write any buffered token increments to the database"""
+    global _flush_timer
+    with _pending_lock:
+        _flush_timer = None
+        with get_db_connection() as conn:
+            _write_pending_tokens(conn)
+
+def _read_token_usage(session_id):
+    """Stored usage plus unflushed increments (caller holds _pending_lock)"""
     with get_db_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute('SELECT session_tokens, total_tokens FROM token_usage WHERE session_id = ?', ('main',))
+        cursor.execute('SELECT session_tokens, total_tokens FROM token_usage WHERE session_id = ?', (session_id,))
         row = cursor.fetchone()
-        if row:
-            return {'session_tokens': row[0], 'total_tokens': row[1]}
-        return {'session_tokens': 0, 'total_tokens': 0}
+    session_tokens, total_tokens = _pending_tokens.get(session_id, (0, 0))
+    if row:
+        session_tokens += row[0]
+        total_tokens += row[1]
+    return {'session_tokens': session_tokens, 'total_tokens': total_tokens}
 
-def update_token_usage(session_tokens_increment=0, total_tokens_increment=0):
-    """Update token usage in database"""
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
-            UPDATE token_usage 
-            SET session_tokens = session_tokens + ?,
-                total_tokens = total_tokens + ?,
-                last_updated = CURRENT_TIMESTAMP
-            WHERE session_id = ?
-        ''', (session_tokens_increment, total_tokens_increment, 'main'))
-        conn.commit()
+def get_token_usage(session_id=DEFAULT_SESSION_ID):
+    """Get current token usage from database, including unflushed increments"""
+    with _pending_lock:
+        return _read_token_usage(session_id)
 
-def reset_session_tokens():
+def update_token_usage(session_tokens_increment=0, total_tokens_increment=0, session_id=DEFAULT_SESSION_ID):
+    """Record token usage and return the updated totals; the database write is batched"""
+    global _flush_timer
+    with _pending_lock:
+        pending = _pending_tokens.setdefault(session_id, [0, 0])
+        pending[0] += session_tokens_increment
+        pending[1] += total_tokens_increment
+        if _flush_timer is None:
+            _flush_timer = threading.Timer(TOKEN_FLUSH_INTERVAL, flush_token_usage)
+            _flush_timer.daemon = True
+            _flush_timer.start()
+        return _read_token_usage(session_id)
+
+def reset_session_tokens(session_id=DEFAULT_SESSION_ID):
     """Reset session tokens (useful for new sessions)"""
+    with _pending_lock:
+        with get_db_connection() as conn:
+            # Keep buffered usage in the running total before zeroing the session
+            _write_pending_tokens(conn)
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE token_usage
+                SET session_tokens = 0,
+                    last_updated = CURRENT_TIMESTAMP
+                WHERE session_id = ?
+            ''', (session_id,))
+            conn.commit()
+
+atexit.register(flush_token_usage)
+
+# Completed OpenAI responses, keyed by a hash of the request inputs, so repeating a
+# request is answered from the database instead of the API
+RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', str(7 * 24 * 3600)))
+CACHE_POLICIES = frozenset({'enabled', 'replay', 'disabled'})
+
+def response_cache_keys(original_content, model, temperature, max_tokens, num_replicas):
+    """One SHA-256 key per replica index, built only from inputs that repeat with the request
+
+    The theme and colors drawn at random per request are deliberately left out, so a repeated
+    request finds the replicas (and the themes they were generated with) from the first one.
+    """
+    digest = hashlib.sha256(SYSTEM_PROMPT.encode())
+    digest.update(b'\0')
+    digest.update(original_content.encode())
+    digest.update(f"|{model}|{temperature}|{max_tokens}|{num_replicas}".encode())
+    keys = []
+    for i in range(1, num_replicas + 1):
+        replica_digest = digest.copy()
+        replica_digest.update(f"|{i}".encode())
+        keys.append(replica_digest.hexdigest())
+    return keys
+
+def get_cached_response(cache_key):
+    """Return the stored response text for cache_key, or None if absent or expired"""
     with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
-            UPDATE token_usage 
-            SET session_tokens = 0,
-                last_updated = CURRENT_TIMESTAMP
-            WHERE session_id = ?
-        ''', ('main',))
+        row = conn.execute(
+            'SELECT response FROM response_cache WHERE cache_key = ? AND created_at > ?',
+            (cache_key, time.time() - RESPONSE_CACHE_TTL)
+        ).fetchone()
+    return row[0] if row else None
+
+def store_cached_response(cache_key, response_text):
+    """Save a response for later identical requests, evicting expired entries"""
+    now = time.time()
+    with get_db_connection() as conn:
+        conn.execute('DELETE FROM response_cache WHERE created_at <= ?', (now - RESPONSE_CACHE_TTL,))
+        conn.execute(
+            'INSERT OR REPLACE INTO response_cache (cache_key, response, created_at) VALUES (?, ?, ?)',
+            (cache_key, response_text, now)
+        )
         conn.commit()
 
 # Initialize database on startup
@@ -98,12 +275,217 @@ init_database()
 openai_api_key = os.getenv('OPENAI_API_KEY', '')
 openai.api_key = openai_api_key
 
+# Chat model used for replica generation and the cap on tokens it may emit per replica
+OPENAI_MODEL = os.getenv('OPENAI_MODEL', 'gpt-4o-mini')
+OPENAI_MAX_TOKENS = int(os.getenv('OPENAI_MAX_TOKENS', '2500'))
+REPLICA_TEMPERATURE = 0.7
+
 # Validate API key on startup
 if not openai_api_key:
-    print("WARNING: OpenAI API key not found! Please check your .env file.")
-    print("Make sure you have a .env file with OPENAI_API_KEY=your_key_here")
+    logger.warning("OpenAI API key not found! Please check your .env file.")
+    logger.warning("Make sure you have a .env file with OPENAI_API_KEY=your_key_here")
 else:
-    print(f"✅ OpenAI API key loaded: {openai_api_key[:10]}...{openai_api_key[-10:]}")
+    logger.info("OpenAI API key loaded: %s...%s", openai_api_key[:10], openai_api_key[-10:])
+
+# Diverse themes for replicas with context-specific content
+THEMES = (
+    "Coffee Shop Manager", "Pizza Restaurant", "Bakery Counter", "Grocery Store",
+    "Bookstore Inventory", "Game Store", "Electronics Shop", "Fashion Boutique",
+    "Pet Store Manager", "Flower Shop", "Music Store", "Art Gallery",
+    "Sports Equipment", "Candy Store", "Toy Shop", "Pharmacy Counter",
+    "Hardware Store", "Car Rental", "Hotel Booking", "Travel Agency",
+    "Fitness Gym", "Restaurant Menu", "Library System", "Movie Theater",
+    "School Supplies", "Photography Studio", "Beauty Salon", "Laundromat",
+    "Ice Cream Parlor", "Juice Bar", "Bike Rental", "Camping Gear",
+    "Wedding Planner", "Food Truck", "Antique Shop", "Craft Store",
+    "Supermarket Chain", "Farmers Market", "Butcher Shop", "Seafood Market",
+    "Book Café", "Tattoo Studio", "Barbershop", "Nail Salon",
+    "Daycare Center", "E-learning Platform", "Music Academy", "Dance Studio",
+    "Driving School", "Language School", "Martial Arts Dojo", "Cooking Class",
+    "Event Venue", "Conference Center", "Coworking Space", "Startup Incubator",
+    "Real Estate Agency", "Property Rental", "Interior Design Studio", "Furniture Store",
+    "Home Decor Shop", "Lighting Store", "Appliance Store", "Mattress Shop",
+    "Garden Center", "Plant Nursery", "Organic Store", "Wine Shop",
+    "Brewery Taproom", "Sports Bar", "Nightclub Manager", "Concert Hall",
+    "Theater Playhouse", "Amusement Park", "Zoo Management", "Aquarium Center",
+    "Theme Park", "Arcade Center", "Escape Room", "Bowling Alley",
+    "Skating Rink", "Golf Course", "Tennis Club", "Soccer Academy",
+    "Hospital Management", "Clinic Reception", "Dental Office", "Veterinary Clinic",
+    "Pharmaceutical Store", "Optical Shop", "Hearing Aid Center", "Rehab Center",
+    "Courier Service", "Logistics Hub", "Airline Booking", "Shipping Company",
+    "Taxi Service", "Ride Sharing", "Parking Garage", "Fuel Station",
+    "Tech Repair Shop", "Mobile Store", "Laptop Store", "Watch Boutique",
+    "Jewelry Store", "Perfume Shop", "Handbag Boutique", "Shoe Store",
+    "Surf Shop", "Diving Center", "Ski Resort", "Snowboard Shop",
+    "Mountain Guide", "Hiking Supplies", "Fishing Store", "Hunting Shop",
+    "Board Game Café", "VR Arcade", "Esports Arena", "Streaming Studio",
+    "Podcast Studio", "Radio Station", "TV Channel Manager", "Film Production",
+    "Animation Studio", "Advertising Agency", "Consulting Firm", "HR Platform",
+    "Payroll Service", "Law Firm", "Notary Office", "Insurance Agency",
+    "Bank Branch", "Stock Brokerage", "Investment Firm", "Cryptocurrency Exchange",
+    "Charity Organization", "NGO Manager", "Volunteer Center", "Community Center",
+    "Religious Organization", "Church Management", "Mosque Administration", "Temple Management",
+    "Resort Manager", "Holiday Park", "Hostel Manager", "Bed and Breakfast",
+    "Vacation Rentals", "Timeshare Service", "RV Rental", "Yacht Rental",
+    "Cruise Line", "Train Service", "Metro Station", "Bus Depot",
+    "Trucking Company", "Warehousing Hub", "Cold Storage", "Freight Forwarding",
+    "Drone Delivery", "Postal Service", "Bike Courier", "Farmland Manager",
+    "Dairy Farm", "Poultry Farm", "Fishery Farm", "Aquaponics Farm",
+    "Greenhouse Farming", "Hydroponics Farm", "Crop Trading", "Fertilizer Shop",
+    "Seed Store", "Tractor Rental", "Mining Operations", "Oil Refinery",
+    "Solar Energy Plant", "Wind Farm", "Hydropower Plant", "Recycling Plant",
+    "Construction Firm", "Architecture Studio", "Cement Factory", "Steel Plant",
+    "Clothing Store", "Streetwear Shop", "Sports Apparel", "Tailor Shop",
+    "Textile Factory", "Leather Goods", "Accessories Store", "Cap Store",
+    "Restaurant Chain", "Buffet Restaurant", "Fine Dining", "Fast Food Outlet",
+    "Burger Joint", "Sandwich Shop", "Steakhouse", "Seafood Restaurant",
+    "Vegan Café", "Salad Bar", "Soup Kitchen", "Catering Service",
+    "Ramen Shop", "Sushi Bar", "Dim Sum Place", "Mexican Cantina",
+    "French Bistro", "Greek Taverna", "Turkish Kebab Shop", "Caribbean Restaurant",
+    "Cupcake Store", "Donut Shop", "Chocolate Boutique", "Crepe Stand",
+    "Pancake House", "Waffle Bar", "Coffee Roastery", "Bubble Tea Shop",
+    "Gaming Café", "Internet Café", "Makerspace", "Electronics Repair",
+    "Drone Store", "Smart Home Store", "AR Experience Center", "Tech Museum",
+    "Airport Duty Free", "Railway Station Shop", "Pop-Up Shop", "Music Festival Manager",
+    "Conference Organizer", "Sports League Manager", "Basketball Team", "Baseball Team",
+    "Football Club", "Olympics Committee", "Circus Show", "Comedy Club",
+    "Medical Research Lab", "Biotech Startup", "Pharma Manufacturing", "Health Insurance",
+    "Yoga Studio", "Meditation Center", "Spa Resort", "Ayurveda Clinic",
+    "News Agency", "Book Publisher", "Printing Press", "Stationery Shop",
+    "Souvenir Shop", "Gift Wrapping Service", "Party Supplies", "Costume Rental",
+    "Photo Booth", "DJ Service", "Karaoke Bar", "Open Mic Café",
+    "Software Company", "Web Design Agency", "Game Development Studio", "Cloud Hosting",
+    "Robotics Startup", "IoT Platform", "Blockchain Startup", "Metaverse Hub",
+    "Wildlife Sanctuary", "National Park", "Botanical Garden", "Heritage Site",
+    "Science Center", "Planetarium", "Space Observatory", "Rocket Launch Center",
+    "City Hall", "Post Office", "Police Department", "Fire Department",
+    "Ambulance Service", "Disaster Relief", "Customs Office", "Immigration Service",
+    "Military Base", "Airport Security", "Playground", "Water Park",
+    "Laser Tag Arena", "Go-Kart Track", "Horse Riding School", "Animal Shelter",
+    "Dog Grooming", "Cat Café",
+    "Elder Care Home", "Retirement Community", "Boarding School", "University Campus",
+    "Student Housing", "Scholarship Fund", "Exam Prep Center", "Research Institute",
+    "IT Training Center", "Coding Bootcamp", "Virtual Classroom", "MOOC Platform",
+    "Job Portal", "Freelance Marketplace", "Gig Economy Platform", "Remote Work Hub",
+    "Interior Landscaping", "Pool Maintenance", "Roofing Company", "Home Renovation",
+    "Carpentry Workshop", "Plumbing Services", "Electrical Services", "Solar Installer",
+    "Moving Company", "Cleaning Services", "Pest Control", "Security Services",
+    "CCTV Store", "Alarm Installation", "Locksmith Services", "Smart Security Hub",
+    "Baby Store", "Maternity Shop", "Toy Rental", "Kids Party Planner",
+    "Children’s Bookstore", "Comic Convention", "Cosplay Shop", "Boarding Kennel",
+    "Pet Daycare", "Pet Hotel", "Exotic Pet Store", "Aquarium Fish Shop",
+    "Bird Store", "Reptile Shop", "Pet Grooming School", "Dog Training Center",
+    "Organic Bakery", "Gluten-Free Store", "Keto Café", "Protein Bar",
+    "Smoothie Shop", "Vegan Market", "Ethnic Grocery", "Spice Shop",
+    "Olive Oil Shop", "Cheese Store", "Butcher Deli", "Farm-to-Table Restaurant",
+    "Artisan Coffee Roaster", "Craft Brewery", "Whiskey Distillery", "Gin Bar",
+    "Cigar Lounge", "Shisha Café", "Hookah Bar", "Wine Tasting Room",
+    "Luxury Spa", "Thermal Baths", "Hot Spring Resort", "Detox Center",
+    "Pilates Studio", "CrossFit Gym", "Boxing Club", "Climbing Gym",
+    "Skateboard Shop", "Roller Rink", "Parkour Gym", "Adventure Park",
+    "Drone Racing Arena", "RC Car Track", "Model Train Store", "LEGO Store",
+    "3D Printing Service", "Makers Lab", "Prototype Studio", "Electronics Lab",
+    "AR Gaming Arena", "Mixed Reality Studio", "Digital Art Gallery", "NFT Marketplace",
+    "Crypto Mining Farm", "Token Exchange", "DeFi Platform", "Metaverse Land Agency",
+    "Virtual Fashion Boutique", "VR Fitness Studio", "Online Casino", "Sports Betting",
+    "Horse Racing Track", "Dog Racing Arena", "Lottery Kiosk", "Bingo Hall",
+    "Community Radio", "Indie Film Studio", "Streaming Platform", "Music Label",
+    "Talent Scout", "Modeling Agency", "Casting Studio", "Script Writing Agency",
+    "Translation Service", "Subtitling Service", "Voiceover Studio", "Dubbing Studio",
+    "Content Creation Hub", "Influencer Agency", "Social Media Agency", "SEO Firm",
+    "Data Analytics Firm", "AI Consultancy", "ML Research Lab", "Cloud AI Service",
+    "Drone Photography", "Aerial Mapping", "Survey Company", "GIS Mapping",
+    "Real Estate Drone Tours", "Property Management", "Condominium Manager", "HOA Manager",
+    "Urban Planning Firm", "Smart City Platform", "Transport Authority", "Highway Management",
+    "Port Authority", "Shipyard", "Harbor Management", "Fisherman’s Wharf",
+    "Luxury Car Dealer", "Used Car Dealer", "Motorcycle Shop", "Scooter Rental",
+    "EV Charging Station", "EV Rental", "Battery Swap Station", "Green Energy Store",
+    "Charcoal Shop", "BBQ Supplies", "Kitchen Equipment Store", "Cooking Oil Shop",
+    "Packaging Supplies", "Paper Mill", "Printing Ink Store", "Label Printing",
+    "Advertising Print Shop", "Merchandise Store", "Souvenir Kiosk", "Festival Booth",
+    "Holiday Decor Store", "Halloween Shop", "Christmas Market", "Fireworks Stand",
+    "Gift Basket Store", "Luxury Gifting Service", "Diamond Store", "Gemstone Boutique",
+    "Goldsmith", "Silversmith", "Engraving Shop", "Watch Customization",
+    "Vintage Car Rental", "Classic Car Restoration", "Motor Garage", "Auto Parts Shop",
+    "Tire Shop", "Car Wash", "Detailing Center", "Tow Truck Service",
+    "Scrapyard", "Metal Recycling", "E-waste Recycling", "Battery Recycling",
+    "Eco-Friendly Products", "Zero Waste Store", "Thrift Shop", "Second-Hand Store",
+    "Pawn Broker", "Consignment Store", "Auction House", "Art Auction",
+    "Collector’s Shop", "Stamp Shop", "Coin Shop", "Antique Bookstore",
+    "Rare Vinyl Store", "Vintage Clothing Shop", "Retro Arcade", "Classic Game Shop"
+)
+
+_THEME_SUFFIX_DROP_RE = re.compile(r'store|shop|manager')
+
+def _make_theme_suffix(theme):
+    """Build the ID suffix for a theme, e.g. 'Coffee Shop Manager' -> 'coffee'"""
+    return _THEME_SUFFIX_DROP_RE.sub('', theme.lower().replace(' ', '-')).strip('-')
+
+# Theme-specific ID suffix for each entry in THEMES
+THEME_SUFFIXES = tuple(_make_theme_suffix(theme) for theme in THEMES)
+
+# Color palettes assigned to replicas (primary, secondary, accent, background, text)
+COLOR_SCHEMES = (
+    {"primary": "#FF6B6B", "secondary": "#4ECDC4", "accent": "#45B7D1", "background": "#F8F9FA", "text": "#2C3E50"},  # Coral & Teal
+    {"primary": "#6C5CE7", "secondary": "#FD79A8", "accent": "#FDCB6E", "background": "#DDD6FE", "text": "#2D3748"},  # Purple & Pink
+    {"primary": "#00B894", "secondary": "#FF7675", "accent": "#74B9FF", "background": "#F0FDF4", "text": "#1A202C"},  # Green & Red
+    {"primary": "#E17055", "secondary": "#81ECEC", "accent": "#A29BFE", "background": "#FFF5F5", "text": "#2C5282"},  # Orange & Cyan
+    {"primary": "#00CEC9", "secondary": "#FDCB6E", "accent": "#E84393", "background": "#F0FDFA", "text": "#1A365D"},  # Turquoise & Yellow
+    {"primary": "#6C5CE7", "secondary": "#00B894", "accent": "#FF7675", "background": "#EDF2F7", "text": "#2D3748"},  # Purple & Green
+    {"primary": "#FD79A8", "secondary": "#74B9FF", "accent": "#FDCB6E", "background": "#FFF0F6", "text": "#1A202C"},  # Pink & Blue
+    {"primary": "#00B894", "secondary": "#E17055", "accent": "#A29BFE", "background": "#F7FAFC", "text": "#2C5282"},  # Mint & Orange
+    {"primary": "#FF7675", "secondary": "#81ECEC", "accent": "#FDCB6E", "background": "#FFFAF0", "text": "#1A365D"},  # Red & Aqua
+    {"primary": "#A29BFE", "secondary": "#55A3FF", "accent": "#FD79A8", "background": "#F8FAFC", "text": "#2D3748"},  # Lavender & Sky Blue
+    {"primary": "#FF9F43", "secondary": "#70A1FF", "accent": "#5F27CD", "background": "#FFF8E1", "text": "#1A202C"},  # Orange & Periwinkle
+    {"primary": "#1DD1A1", "secondary": "#FF6B6B", "accent": "#3742FA", "background": "#F0FFF4", "text": "#2C5282"},  # Seafoam & Coral
+    {"primary": "#FF3838", "secondary": "#2ECC71", "accent": "#F39C12", "background": "#FEF5E7", "text": "#1A365D"},  # Bright Red & Emerald
+    {"primary": "#8E44AD", "secondary": "#1ABC9C", "accent": "#E67E22", "background": "#F4F1FF", "text": "#2D3748"},  # Violet & Turquoise
+    {"primary": "#E74C3C", "secondary": "#3498DB", "accent": "#F1C40F", "background": "#FDF2F8", "text": "#1A202C"},  # Crimson & Dodger Blue
+    {"primary": "#9B59B6", "secondary": "#16A085", "accent": "#D35400", "background": "#FAF5FF", "text": "#2C5282"},  # Amethyst & Teal
+    {"primary": "#27AE60", "secondary": "#E91E63", "accent": "#FF9800", "background": "#F7FDF0", "text": "#1A365D"},  # Forest Green & Pink
+    {"primary": "#3F51B5", "secondary": "#4CAF50", "accent": "#FF5722", "background": "#F3F4FF", "text": "#2D3748"},  # Indigo & Green
+    {"primary": "#673AB7", "secondary": "#009688", "accent": "#FFC107", "background": "#F8F5FF", "text": "#1A202C"},  # Deep Purple & Teal
+    {"primary": "#795548", "secondary": "#2196F3", "accent": "#FF4081", "background": "#F5F5DC", "text": "#2C5282"},  # Brown & Blue
+    {"primary": "#DC143C", "secondary": "#20B2AA", "accent": "#FFD700", "background": "#FFF8DC", "text": "#191970"},  # Crimson & Light Sea Green
+    {"primary": "#FF1493", "secondary": "#00CED1", "accent": "#32CD32", "background": "#F0F8FF", "text": "#4B0082"},  # Deep Pink & Dark Turquoise
+    {"primary": "#8B008B", "secondary": "#FF8C00", "accent": "#00FA9A", "background": "#F5FFFA", "text": "#2F4F4F"},  # Dark Magenta & Dark Orange
+    {"primary": "#B22222", "secondary": "#48D1CC", "accent": "#9ACD32", "background": "#FFFAFA", "text": "#556B2F"},  # Fire Brick & Medium Turquoise
+    {"primary": "#4169E1", "secondary": "#FF6347", "accent": "#9370DB", "background": "#F0F0F0", "text": "#8B4513"},  # Royal Blue & Tomato
+    {"primary": "#228B22", "secondary": "#DA70D6", "accent": "#FFA500", "background": "#F5F5F5", "text": "#800000"},  # Forest Green & Orchid
+    {"primary": "#FF4500", "secondary": "#7B68EE", "accent": "#20B2AA", "background": "#FAFAFA", "text": "#2E8B57"},  # Orange Red & Medium Slate Blue
+    {"primary": "#8A2BE2", "secondary": "#00FF7F", "accent": "#FF69B4", "background": "#F8F8FF", "text": "#8B0000"},  # Blue Violet & Spring Green
+    {"primary": "#CD5C5C", "secondary": "#40E0D0", "accent": "#FFDAB9", "background": "#FDF5E6", "text": "#6B8E23"},  # Indian Red & Turquoise
+    {"primary": "#1E90FF", "secondary": "#FFB6C1", "accent": "#98FB98", "background": "#F0FFFF", "text": "#A0522D"},  # Dodger Blue & Light Pink
+    {"primary": "#32CD32", "secondary": "#FF1493", "accent": "#87CEEB", "background": "#FFFACD", "text": "#8B008B"},  # Lime Green & Deep Pink
+    {"primary": "#FF8C00", "secondary": "#4682B4", "accent": "#DDA0DD", "background": "#FFF0F5", "text": "#006400"},  # Dark Orange & Steel Blue
+    {"primary": "#9932CC", "secondary": "#FF7F50", "accent": "#7FFFD4", "background": "#F5FFFA", "text": "#B22222"},  # Dark Orchid & Coral
+    {"primary": "#FF69B4", "secondary": "#2E8B57", "accent": "#F0E68C", "background": "#F8F8FF", "text": "#4B0082"},  # Hot Pink & Sea Green
+    {"primary": "#DC143C", "secondary": "#00BFFF", "accent": "#ADFF2F", "background": "#FFFAF0", "text": "#8B4513"},  # Crimson & Deep Sky Blue
+    {"primary": "#8B0000", "secondary": "#00FFFF", "accent": "#FFE4B5", "background": "#FFF5EE", "text": "#2F4F4F"},  # Dark Red & Cyan
+    {"primary": "#4B0082", "secondary": "#FF6347", "accent": "#98FB98", "background": "#F0F8FF", "text": "#8B4513"},  # Indigo & Tomato
+    {"primary": "#006400", "secondary": "#FF1493", "accent": "#F0E68C", "background": "#FFFACD", "text": "#8B008B"},  # Dark Green & Deep Pink
+    {"primary": "#FF4500", "secondary": "#4169E1", "accent": "#DDA0DD", "background": "#FFF8DC", "text": "#2E8B57"},  # Orange Red & Royal Blue
+    {"primary": "#8B008B", "secondary": "#32CD32", "accent": "#FFB6C1", "background": "#F5F5DC", "text": "#800000"},  # Dark Magenta & Lime Green
+    {"primary": "#B22222", "secondary": "#00CED1", "accent": "#FFDAB9", "background": "#F0FFFF", "text": "#556B2F"},  # Fire Brick & Dark Turquoise
+    {"primary": "#9370DB", "secondary": "#FF8C00", "accent": "#87CEEB", "background": "#F8F8FF", "text": "#A0522D"},  # Medium Purple & Dark Orange
+    {"primary": "#20B2AA", "secondary": "#DC143C", "accent": "#F5DEB3", "background": "#FFFAFA", "text": "#8B0000"},  # Light Sea Green & Crimson
+    {"primary": "#FF6347", "secondary": "#4B0082", "accent": "#E0FFFF", "background": "#FDF5E6", "text": "#2F4F4F"},  # Tomato & Indigo
+    {"primary": "#00FA9A", "secondary": "#8B008B", "accent": "#FFEFD5", "background": "#F5FFFA", "text": "#B22222"},  # Medium Spring Green & Dark Magenta
+    {"primary": "#7B68EE", "secondary": "#FF4500", "accent": "#F0F8FF", "background": "#FAFAFA", "text": "#2E8B57"},  # Medium Slate Blue & Orange Red
+    {"primary": "#FF69B4", "secondary": "#228B22", "accent": "#FFE4E1", "background": "#F0F0F0", "text": "#8B4513"},  # Hot Pink & Forest Green
+    {"primary": "#4682B4", "secondary": "#FF8C00", "accent": "#F5FFFA", "background": "#FFF5EE", "text": "#006400"},  # Steel Blue & Dark Orange
+    {"primary": "#2E8B57", "secondary": "#FF69B4", "accent": "#FFF8DC", "background": "#F8F8FF", "text": "#4B0082"},  # Sea Green & Hot Pink
+    {"primary": "#00BFFF", "secondary": "#DC143C", "accent": "#FFFACD", "background": "#F0FFFF", "text": "#8B0000"},  # Deep Sky Blue & Crimson
+    {"primary": "#FF7F50", "secondary": "#9932CC", "accent": "#E6E6FA", "background": "#FFF0F5", "text": "#2F4F4F"},  # Coral & Dark Orchid
+)
+
+# Replica metadata fields and the tag_names prefix each one is read from
+REPLICA_TAG_PREFIXES = (
+    ('subtopic', 'SUB_TOPIC_'),
+    ('course', 'COURSE_'),
+    ('module', 'MODULE_'),
+    ('unit', 'UNIT_'),
+)
 
 def extract_tag_value(tag_list, prefix):
     """Extract value from tag list based on prefix"""
@@ -127,9 +509,12 @@ def format_test_cases_from_original(original_test_cases, num_replicas=None):
     if num_replicas and num_replicas < max_test_cases:
         max_test_cases = num_replicas
     
+    # Draw the randomness for every test case UUID in a single call
+    random_bytes = os.urandom(16 * max_test_cases)
+    
     for i, test_case in enumerate(original_test_cases[:max_test_cases]):
         # Generate unique UUID for each test case
-        test_case_id = str(uuid.uuid4())
+        test_case_id = str(uuid.UUID(bytes=random_bytes[i * 16:(i + 1) * 16], version=4))
         
         formatted_test_case = {
             "id": test_case_id,
@@ -145,21 +530,133 @@ def format_test_cases_from_original(original_test_cases, num_replicas=None):
     
     return formatted_test_cases
 
-def count_tokens(text, model="gpt-3.5-turbo"):
+def copy_test_cases_with_new_ids(test_cases):
+    """Copy formatted test cases, giving each copy a fresh UUID so replicas never share ids"""
+    random_bytes = os.urandom(16 * len(test_cases))
+    return [
+        dict(test_case, id=str(uuid.UUID(bytes=random_bytes[i * 16:(i + 1) * 16], version=4)))
+        for i, test_case in enumerate(test_cases)
+    ]
+
+# Loaded tiktoken encodings by model; a failed load is retried after ENCODING_RETRY_SECONDS
+ENCODING_RETRY_SECONDS = 60
+_encodings = {}
+_encoding_retry_at = {}
+
+def _get_encoding(model):
+    """Load the tiktoken encoding for a model once and reuse it; None while it can't be loaded"""
+    encoding = _encodings.get(model)
+    if encoding is not None:
+        return encoding
+    if time.monotonic() < _encoding_retry_at.get(model, 0):
+        return None
+    try:
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            # Unknown model name - fall back to the chat models' encoding
+            encoding = tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        # Typically the encoding file could not be downloaded; estimate from length until the
+        # retry window passes instead of retrying the download on every count
+        logger.warning("Could not load tiktoken encoding for %s, estimating token counts: %s", model, e)
+        _encoding_retry_at[model] = time.monotonic() + ENCODING_RETRY_SECONDS
+        return None
+    _encodings[model] = encoding
+    return encoding
+
+# Longest text handed to the tokenizer in one piece; see count_tokens
+MAX_TOKENIZE_CHARS = int(os.getenv('MAX_TOKENIZE_CHARS', '200000'))
+
+def count_tokens(text, model=OPENAI_MODEL):
     """Count tokens in text using tiktoken"""
+    if not text:
+        return 0
+    if len(text) < 4:
+        # Anything this short encodes to a single token in practice
+        return 1
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return (len(text) + 3) // 4
     try:
-        encoding = tiktoken.encoding_for_model(model)
-        return len(encoding.encode(text))
-    except:
-        # Fallback estimation
-        return len(text.split()) * 1.3
+        if len(text) > MAX_TOKENIZE_CHARS:
+            # BPE cost grows superlinearly on pathological input, so only encode a bounded
+            # prefix and extrapolate the remainder at ~4 characters per token
+            return len(encoding.encode_ordinary(text[:MAX_TOKENIZE_CHARS])) + (len(text) - MAX_TOKENIZE_CHARS + 3) // 4
+        return len(encoding.encode_ordinary(text))
+    except Exception:
+        # Fallback estimation (~4 characters per token)
+        return (len(text) + 3) // 4
+
+def count_message_tokens(messages, model=OPENAI_MODEL):
+    """Prompt tokens for a chat messages list, including the per-message framing overhead"""
+    return sum(count_tokens(message['content'], model) + 4 for message in messages)
+
+# Pre-warm the default encoding so the first request doesn't pay for loading it
+_get_encoding(OPENAI_MODEL)
+
+# Precompiled patterns for cleaning and parsing OpenAI responses
+_UNESCAPED_QUOTES_RE = re.compile(r'(:\s*")([^"]*)"([^"]*)"([^"]*)"')
+_TRAILING_COMMA_RE = re.compile(r',(\s*[}\]])')
+_MISSING_COMMA_RE = re.compile(r'}(\s*)"')
+_STRING_TOKEN_RE = re.compile(r'["\\\n]')
+_CONTROL_CHARS_TABLE = str.maketrans({'\n': '\\n', '\r': '\\r', '\t': '\\t'})
+
+_THEME_RE = re.compile(r'THEME:\s*(.+)')
+_REPLICA_SUFFIX_RE = re.compile(r'\s*-?\s*Replica\s*\d*\s*', re.IGNORECASE)
+_SECTION_RE = re.compile(r'(HTML|CSS|JS|QUESTION|TESTS)_START\s*(.*?)\s*\1_END', re.DOTALL)
+
+# Section markers every replica response must contain (JS is optional: responsive
+# replicas are HTML + CSS only)
+REQUIRED_MARKERS = (
+    'HTML_START', 'HTML_END', 'CSS_START', 'CSS_END',
+    'QUESTION_START', 'QUESTION_END', 'TESTS_START', 'TESTS_END'
+)
+
+_PLACEHOLDER_RE = re.compile(r'\{\{(\w+)\}\}')
+
+def _escape_newlines_in_strings(json_str):
+    """Escape raw newlines that appear inside JSON string values (single pass)"""
+    if '\n' not in json_str:
+        return json_str
+    
+    fixed_parts = []
+    in_string = False
+    escaped_pos = -1
+    last = 0
+    
+    for match in _STRING_TOKEN_RE.finditer(json_str):
+        pos = match.start()
+        if pos == escaped_pos:
+            continue
+        
+        char = match.group()
+        if char == '\\':
+            if in_string:
+                escaped_pos = pos + 1
+        elif char == '"':
+            in_string = not in_string
+        elif in_string:
+            fixed_parts.append(json_str[last:pos])
+            fixed_parts.append('\\n')
+            last = pos + 1
+    
+    fixed_parts.append(json_str[last:])
+    return ''.join(fixed_parts)
 
 def clean_openai_json_response(response_text):
     """Clean and fix common JSON issues in OpenAI responses"""
-    import re
+    cleaned = response_text.strip()
+    
+    # Fast path: the response is already a bare, valid JSON object
+    if cleaned.startswith('{') and cleaned.endswith('}'):
+        try:
+            orjson.loads(cleaned)
+            return cleaned
+        except orjson.JSONDecodeError:
+            pass
     
     # Remove markdown code blocks
-    cleaned = response_text.strip()
     if cleaned.startswith('```json'):
         cleaned = cleaned[7:]
     elif cleaned.startswith('```'):
@@ -182,133 +679,126 @@ def clean_openai_json_response(response_text):
     # This is a simple approach - we'll try to parse as-is first
     try:
         # Test if it parses correctly
-        json.loads(json_content)
+        orjson.loads(json_content)
         return json_content
-    except json.JSONDecodeError:
+    except orjson.JSONDecodeError:
         # If it fails, try some basic fixes
         
         # Fix unescaped newlines in strings
-        json_content = re.sub(r'(?<!\\)\n(?=.*"[^"]*$)', '\\n', json_content)
+        json_content = _escape_newlines_in_strings(json_content)
         
         # Try again
         try:
-            json.loads(json_content)
+            orjson.loads(json_content)
             return json_content
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             # Return as-is and let the caller handle the error
             return json_content
 
 def attempt_json_repair(response_text):
     """Attempt more aggressive JSON repair strategies"""
-    import re
-    
     try:
-        # Start with basic cleaning
-        cleaned = clean_openai_json_response(response_text)
-        
-        # More aggressive repair strategies
-        repair_strategies = [
-            # Strategy 1: Fix newlines and control characters first
-            lambda s: s.replace('\n', '\\n').replace('\r', '\\r').replace('\t', '\\t'),
-            
-            # Strategy 2: Fix unescaped quotes in code strings
-            lambda s: re.sub(r'(:\s*")([^"]*)"([^"]*)"([^"]*)"', r'\1\2\\"\3\\"\4"', s),
-            
-            # Strategy 3: Fix trailing commas
-            lambda s: re.sub(r',(\s*[}\]])', r'\1', s),
-            
-            # Strategy 4: Try to close unterminated strings
-            lambda s: fix_unterminated_strings(s),
-            
-            # Strategy 5: Fix missing commas
-            lambda s: re.sub(r'}(\s*)"', r'},\1"', s),
-        ]
-        
-        current_json = cleaned
+        # Start with basic cleaning; if that already parses, no repair is needed
+        current_json = clean_openai_json_response(response_text)
+        try:
+            orjson.loads(current_json)
+            return current_json
+        except orjson.JSONDecodeError:
+            pass
         
-        for i, strategy in enumerate(repair_strategies):
+        # Apply the strategies cumulatively, stopping at the first result that parses
+        for i, strategy in enumerate(_REPAIR_STRATEGIES):
             try:
-                repaired = strategy(current_json)
-                json.loads(repaired)  # Test if it parses
-                print(f"JSON repair successful with strategy {i+1}")
-                return repaired
-            except (json.JSONDecodeError, Exception) as e:
-                print(f"Strategy {i+1} failed: {e}")
-                current_json = repaired if 'repaired' in locals() else current_json
+                current_json = strategy(current_json)
+                orjson.loads(current_json)  # Test if it parses
+            except Exception:
                 continue
+            logger.debug("JSON repair successful with strategy %d", i + 1)
+            return current_json
         
         # If none work, return None
         return None
         
     except Exception as e:
-        print(f"JSON repair attempt failed: {e}")
+        logger.warning("JSON repair attempt failed: %s", e)
         return None
 
 def fix_unterminated_strings(json_str):
     """Try to fix unterminated strings in JSON"""
-    import re
+    # Single line with balanced quotes - nothing can be left open
+    if '\n' not in json_str and '\\' not in json_str and json_str.count('"') % 2 == 0:
+        return json_str
     
-    # This is a simple heuristic approach
-    # Look for patterns like: "key": "value with unterminated string
-    lines = json_str.split('\n')
-    fixed_lines = []
+    # Walk the quotes, backslashes and newlines once, tracking whether we are
+    # inside a string. A newline reached inside a string closes it on that line.
+    fixed_parts = []
+    in_string = False
+    escaped_pos = -1
+    last = 0
     
-    for line in lines:
-        # Check if line has an unterminated string (odd number of unescaped quotes after colon)
-        if ':' in line:
-            parts = line.split(':', 1)
-            if len(parts) == 2:
-                key_part = parts[0]
-                value_part = parts[1].strip()
-                
-                # Count unescaped quotes in value part
-                unescaped_quotes = 0
-                i = 0
-                while i < len(value_part):
-                    if value_part[i] == '"' and (i == 0 or value_part[i-1] != '\\'):
-                        unescaped_quotes += 1
-                    i += 1
-                
-                # If odd number of quotes and line doesn't end with quote, try to close it
-                if unescaped_quotes % 2 == 1 and not value_part.rstrip().endswith('"'):
-                    line = line.rstrip() + '"'
+    for match in _STRING_TOKEN_RE.finditer(json_str):
+        pos = match.start()
+        if pos == escaped_pos:
+            continue
         
-        fixed_lines.append(line)
+        char = match.group()
+        if char == '\\':
+            if in_string:
+                escaped_pos = pos + 1
+        elif char == '"':
+            in_string = not in_string
+        elif in_string:
+            fixed_parts.append(json_str[last:pos].rstrip())
+            fixed_parts.append('"')
+            last = pos
+            in_string = False
+    
+    fixed_parts.append(json_str[last:])
+    if in_string:
+        fixed_parts.append('"')
     
-    return '\n'.join(fixed_lines)
+    return ''.join(fixed_parts)
+
+# More aggressive repair strategies, applied in order by attempt_json_repair
+_REPAIR_STRATEGIES = (
+    # Strategy 1: Fix newlines and control characters first
+    lambda s: s.translate(_CONTROL_CHARS_TABLE),
+    
+    # Strategy 2: Fix unescaped quotes in code strings
+    lambda s: _UNESCAPED_QUOTES_RE.sub(r'\1\2\\"\3\\"\4"', s),
+    
+    # Strategy 3: Fix trailing commas
+    lambda s: _TRAILING_COMMA_RE.sub(r'\1', s),
+    
+    # Strategy 4: Try to close unterminated strings
+    fix_unterminated_strings,
+    
+    # Strategy 5: Fix missing commas
+    lambda s: _MISSING_COMMA_RE.sub(r'},\1"', s),
+)
 
 def parse_structured_response(response_text):
     """Parse structured text response into replica data"""
-    import re
     try:
         # Extract theme
-        theme_match = re.search(r'THEME:\s*(.+)', response_text)
+        theme_match = _THEME_RE.search(response_text)
         raw_theme = theme_match.group(1).strip() if theme_match else "Untitled Theme"
         
         # Clean up theme - remove any "Replica X" text and ensure it's a clean title
-        theme = re.sub(r'\s*-?\s*Replica\s*\d*\s*', '', raw_theme, flags=re.IGNORECASE).strip()
+        theme = _REPLICA_SUFFIX_RE.sub('', raw_theme).strip()
         if not theme:
             theme = "Custom Theme"
         
-        # Extract HTML
-        html_match = re.search(r'HTML_START\s*(.*?)\s*HTML_END', response_text, re.DOTALL)
-        html_code = html_match.group(1).strip() if html_match else ""
-        
-        # Extract CSS  
-        css_match = re.search(r'CSS_START\s*(.*?)\s*CSS_END', response_text, re.DOTALL)
-        css_code = css_match.group(1).strip() if css_match else ""
-        
-        # Extract JavaScript
-        js_match = re.search(r'JS_START\s*(.*?)\s*JS_END', response_text, re.DOTALL)
-        js_code = js_match.group(1).strip() if js_match else ""
+        # Extract every SECTION_START ... SECTION_END block in one pass (first occurrence wins)
+        sections = {}
+        for section_match in _SECTION_RE.finditer(response_text):
+            sections.setdefault(section_match.group(1), section_match.group(2))
         
-        # Extract question
-        question_match = re.search(r'QUESTION_START\s*(.*?)\s*QUESTION_END', response_text, re.DOTALL)
-        question_text = question_match.group(1).strip() if question_match else ""
-        
-        # Extract test cases
-        tests_match = re.search(r'TESTS_START\s*(.*?)\s*TESTS_END', response_text, re.DOTALL)
-        test_cases_text = tests_match.group(1).strip() if tests_match else ""
+        html_code = sections.get('HTML', '').strip()
+        css_code = sections.get('CSS', '').strip()
+        js_code = sections.get('JS', '').strip()
+        question_text = sections.get('QUESTION', '').strip()
+        test_cases_text = sections.get('TESTS', '').strip()
         
         # Return structured data
         return {
@@ -320,21 +810,24 @@ def parse_structured_response(response_text):
             "test_cases": test_cases_text,  # Keep as text for now, will be formatted later
             "html_solution": html_code,  # Same as html_code
             "css_solution": css_code,    # Same as css_code
-            "js_solution": js_code,      # Same as js_code
-            "subtopic": "",
-            "course": "",
-            "module": "",
-            "unit": ""
+            "js_solution": js_code       # Same as js_code
         }
         
     except Exception as e:
-        print(f"Error parsing structured response: {e}")
+        logger.warning("Error parsing structured response: %s", e)
         return None
 
+# Resolved against this file rather than the working directory, so it loads under gunicorn too
+PROMPT_TEMPLATE_PATH = os.getenv(
+    'PROMPT_TEMPLATE_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'webcoding-replicas-prompt.md')
+)
+
+@lru_cache(maxsize=1)
 def load_prompt_template():
-    """Load the webcoding-replication-prompt.md file"""
+    """Load the webcoding-replication-prompt.md file (cached after the first read)"""
     try:
-        with open('../webcoding-replicas-prompt.md', 'r', encoding='utf-8') as f:
+        with open(PROMPT_TEMPLATE_PATH, 'r', encoding='utf-8') as f:
             return f.read()
     except FileNotFoundError:
         return """
@@ -420,6 +913,307 @@ NUMBER_OF_REPLICAS: {{N}}
 Generate **1** replica with a unique theme while preserving exact functionality.
 """
 
+# Read the template at import so requests never touch the disk (see /api/reload-prompt)
+load_prompt_template()
+
+# Rules shared by every replica; kept free of per-replica values so it is identical across calls
+SYSTEM_PROMPT = """You are a web developer who creates themed code replicas with completely unique contexts and vibrant color schemes. Each request assigns a THEME, an ID SUFFIX and a COLOR SCHEME; apply them to the original content.
+
+OUTPUT FORMAT (plain text, not JSON):
+THEME: <assigned theme>
+HTML_START
+[complete HTML code with unique IDs using the assigned ID suffix]
+HTML_END
+CSS_START
+[complete CSS code with matching selectors and the assigned color scheme]
+CSS_END
+JS_START
+[complete JavaScript code with matching getElementById calls]
+JS_END
+QUESTION_START
+[modified question text in the assigned theme's context]
+QUESTION_END
+TESTS_START
+[test cases separated by newlines, adapted to the assigned theme]
+TESTS_END
+
+THEME REQUIREMENTS:
+1. Transform ALL text content, labels, headings and descriptions to match the assigned theme
+2. Make the entire interface contextually relevant to the theme
+3. Examples: "Calculate Total" -> "Calculate <theme> Total"; "Items" -> contextual items (e.g., "Products", "Books", "Coffees")
+
+ID CONSISTENCY RULES:
+1. ALL HTML element IDs must end with the assigned suffix: id="calculate" -> id="calculate-<suffix>"
+2. ALL JavaScript getElementById calls must match the HTML IDs exactly: getElementById('total') -> getElementById('total-<suffix>')
+3. NO generic IDs
+
+COLOR REQUIREMENTS (use the assigned hex values EXACTLY):
+- Primary: main buttons, headers, important elements
+- Secondary: accents, borders, secondary buttons
+- Accent: hover, focus and active states, highlights
+- Background: main background areas
+- Text: all text content
+- Apply gradients combining primary and secondary, e.g. .header { background: linear-gradient(135deg, <primary>, <secondary>); }
+- Apply shadow effects using rgba versions of the colors and lighter/darker shades for depth
+- Ensure good contrast for readability
+- NO white (#FFFFFF, #FFF, white) or black (#000000, #000, black) backgrounds
+- NO gray (#808080, gray) as primary colors
+
+Generate exactly ONE replica, completely unique to its theme, with vibrant colors."""
+
+SYSTEM_MESSAGE = {"role": "system", "content": SYSTEM_PROMPT}
+
+# The original content goes first and the per-replica assignment last, so every replica's
+# prompt shares one long identical prefix that OpenAI's automatic prompt caching can reuse
+USER_PROMPT_TEMPLATE = """Original content to transform:
+{original_content}
+
+THEME: {theme}
+ID SUFFIX: {theme_suffix}
+COLOR SCHEME:
+- Primary: {primary}
+- Secondary: {secondary}
+- Accent: {accent}
+- Background: {background}
+- Text: {text}
+
+Generate exactly ONE replica with the "{theme}" theme, IDs ending in "-{theme_suffix}", and the color scheme above.
+"""
+
+_REQUIRED_FIELDS = frozenset({
+    'question_text', 'short_text', 'solutions_metadata', 'test_cases', 'replica_type', 'num_replicas'
+})
+
+# Shared pool for the per-replica OpenAI calls so their network waits overlap
+OPENAI_MAX_WORKERS = int(os.getenv('OPENAI_MAX_WORKERS', '8'))
+_replica_executor = ThreadPoolExecutor(max_workers=OPENAI_MAX_WORKERS)
+
+class _SharedSession(requests.Session):
+    """Session shared by every thread; openai's per-thread rotation can't close it for the others"""
+    
+    def close(self):
+        # openai 0.28 closes and replaces each thread's session every MAX_SESSION_LIFETIME_SECS;
+        # with one shared instance that would drop the warm connections of every thread
+        pass
+
+# One keep-alive connection pool for all OpenAI calls, sized to the worker pool, so any
+# worker thread can reuse a warm TLS connection instead of each thread opening its own
+_openai_session = _SharedSession()
+_openai_session.mount(
+    'https://',
+    requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=OPENAI_MAX_WORKERS, max_retries=2)
+)
+openai.requestssession = _openai_session
+
+class RateLimiter:
+    """Token-bucket throttle for the OpenAI requests-per-minute and tokens-per-minute limits.
+
+    Both buckets start full and refill continuously at rpm/60 and tpm/60 per second;
+    a limit of 0 disables that bucket. Limits may be fractional (a per-process share).
+    """
+    
+    def __init__(self, rpm, tpm):
+        self.rpm = rpm
+        self.tpm = tpm
+        # The request bucket must be able to hold at least one whole request
+        self.request_capacity = max(rpm, 1) if rpm else 0
+        self.request_tokens = float(self.request_capacity)
+        self.token_tokens = float(tpm)
+        self.last_update = time.monotonic()
+        self._lock = threading.Lock()
+    
+    @property
+    def enabled(self):
+        return bool(self.rpm or self.tpm)
+    
+    def acquire(self, estimated_tokens=0):
+        """Block until one request and estimated_tokens tokens are available, then take them"""
+        if not self.enabled:
+            return
+        # A single call larger than the whole budget can only ever wait for a full bucket
+        estimated_tokens = min(estimated_tokens, self.tpm) if self.tpm else 0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                elapsed = now - self.last_update
+                self.last_update = now
+                if self.rpm:
+                    self.request_tokens = min(self.request_capacity, self.request_tokens + elapsed * self.rpm / 60)
+                if self.tpm:
+                    self.token_tokens = min(self.tpm, self.token_tokens + elapsed * self.tpm / 60)
+                
+                wait = 0.0
+                if self.rpm and self.request_tokens < 1:
+                    wait = (1 - self.request_tokens) * 60 / self.rpm
+                if self.tpm and self.token_tokens < estimated_tokens:
+                    wait = max(wait, (estimated_tokens - self.token_tokens) * 60 / self.tpm)
+                if wait == 0.0:
+                    if self.rpm:
+                        self.request_tokens -= 1
+                    if self.tpm:
+                        self.token_tokens -= estimated_tokens
+                    return
+            time.sleep(wait)
+
+# Account-level limits for the configured model (0 = unthrottled). Each gunicorn worker
+# process has its own limiter, so each gets an equal share of the account budget;
+# gunicorn.conf.py exports the worker count as WEB_CONCURRENCY
+RATE_LIMIT_PROCESSES = max(1, int(os.getenv('WEB_CONCURRENCY', '1')))
+_rate_limiter = RateLimiter(
+    int(os.getenv('OPENAI_RPM', '0')) / RATE_LIMIT_PROCESSES,
+    int(os.getenv('OPENAI_TPM', '0')) / RATE_LIMIT_PROCESSES
+)
+
+# Transient OpenAI failures (rate limits, 5xx, timeouts, dropped connections) that are worth retrying
+RETRYABLE_OPENAI_ERRORS = (
+    openai.error.RateLimitError,
+    openai.error.APIError,
+    openai.error.Timeout,
+    openai.error.ServiceUnavailableError,
+    openai.error.APIConnectionError,
+)
+
+@retry(
+    wait=wait_random_exponential(min=1, max=60),
+    stop=stop_after_attempt(5),
+    retry=retry_if_exception_type(RETRYABLE_OPENAI_ERRORS),
+    before_sleep=before_sleep_log(logger, logging.WARNING),
+    reraise=True
+)
+def request_completion(i, messages, max_tokens, prompt_tokens=None):
+    """Stream one completion from OpenAI; returns (response_content, input_tokens, output_tokens, finish_reason)
+
+    Transient errors, including ones raised mid-stream, retry the whole request with backoff.
+    prompt_tokens is an optional precomputed size of messages, used for rate limiting and
+    when the stream reports no usage; otherwise it is counted only when one of those needs it.
+    """
+    if _rate_limiter.enabled:
+        if prompt_tokens is None:
+            prompt_tokens = count_message_tokens(messages)
+        # Reserve the worst case: the whole prompt plus a full-length completion
+        estimated_tokens = prompt_tokens + max_tokens
+        _rate_limiter.acquire(estimated_tokens)
+    response = openai.ChatCompletion.create(
+        model=OPENAI_MODEL,
+        messages=messages,
+        max_tokens=max_tokens,
+        temperature=REPLICA_TEMPERATURE,
+        # Anything after the last section is discarded by the parser, so stop generating there
+        stop=["TESTS_END"],
+        stream=True,
+        stream_options={"include_usage": True}
+    )
+    
+    content_parts = []
+    usage = None
+    finish_reason = None
+    for chunk in response:
+        if chunk.get('usage'):
+            usage = chunk.usage
+        if not chunk.choices:
+            continue
+        if chunk.choices[0].get('finish_reason'):
+            finish_reason = chunk.choices[0].finish_reason
+        piece = chunk.choices[0].delta.get('content')
+        if not piece:
+            continue
+        content_parts.append(piece)
+    
+    # The stop sequence itself is not part of the output, so restore it when generation ended
+    # there; output cut off by max_tokens ('length') must stay visibly incomplete
+    response_content = ''.join(content_parts)
+    if finish_reason == 'stop' and 'TESTS_START' in response_content and 'TESTS_END' not in response_content:
+        response_content += '\nTESTS_END'
+    
+    # Prefer the exact counts OpenAI reports at the end of the stream (they differ slightly per
+    # replica and include cache hits); if the usage chunk is missing, fall back to local counts
+    if usage:
+        input_tokens = usage.prompt_tokens
+        output_tokens = usage.completion_tokens
+        cached_tokens = (usage.get('prompt_tokens_details') or {}).get('cached_tokens', 0)
+        logger.debug("Replica %d prompt tokens: %d (%d cached)", i, input_tokens, cached_tokens)
+    else:
+        input_tokens = prompt_tokens if prompt_tokens is not None else count_message_tokens(messages)
+        output_tokens = count_tokens(response_content)
+    
+    return response_content, input_tokens, output_tokens, finish_reason
+
+def generate_single_replica(i, messages, max_tokens, formatted_test_cases, cache_policy='enabled',
+                            prompt_tokens=None, cache_key=None):
+    """Generate and parse one replica; returns (replica_data, input_tokens, output_tokens)
+
+    cache_policy 'enabled' reads and fills the response cache entry cache_key, 'replay'
+    only answers from the cache and 'disabled' always calls the API.
+    """
+    try:
+        if cache_policy == 'disabled':
+            cache_key = None
+        response_content = get_cached_response(cache_key) if cache_key else None
+        
+        from_cache = response_content is not None
+        if from_cache:
+            # A cached answer costs no tokens
+            logger.debug("Replica %d served from the response cache", i)
+            input_tokens = output_tokens = 0
+        elif cache_policy == 'replay':
+            return {"error": f"No cached response for replica {i}"}, 0, 0
+        else:
+            response_content, input_tokens, output_tokens, finish_reason = request_completion(
+                i, messages, max_tokens, prompt_tokens
+            )
+            if finish_reason == 'length':
+                # Never parse or cache a response that ran out of tokens
+                return {
+                    "error": f"Replica {i} response was truncated at {max_tokens} tokens",
+                    "raw_response": response_content[:500]
+                }, input_tokens, output_tokens
+        
+        logger.debug("Replica %d response length: %d", i, len(response_content))
+        
+        # Reject truncated or off-format output before running the parser
+        missing_markers = [marker for marker in REQUIRED_MARKERS if marker not in response_content]
+        if missing_markers:
+            return {
+                "error": f"Replica {i} response is missing sections: {', '.join(missing_markers)}",
+                "raw_response": response_content[:500]
+            }, input_tokens, output_tokens
+        
+        if cache_key and not from_cache:
+            # The replica is already paid for, so a failed cache write must not lose it
+            try:
+                store_cached_response(cache_key, response_content)
+            except sqlite3.Error as e:
+                logger.warning("Could not cache response for replica %d: %s", i, e)
+        
+        try:
+            # Parse the structured text response
+            replica_data = parse_structured_response(response_content)
+            
+            if replica_data:
+                # Replace text test cases with the structured originals (fresh ids per replica)
+                replica_data['test_cases'] = copy_test_cases_with_new_ids(formatted_test_cases)
+                
+                logger.debug("Successfully generated replica %d", i)
+                return replica_data, input_tokens, output_tokens
+            
+            return {
+                "error": f"Failed to parse structured response for replica {i}",
+                "raw_response": response_content[:500]
+            }, input_tokens, output_tokens
+            
+        except Exception as e:
+            logger.warning("Parsing error for replica %d: %s", i, e)
+            return {
+                "error": f"Failed to parse replica {i}: {str(e)}",
+                "raw_response": response_content[:500]
+            }, input_tokens, output_tokens
+        
+    except Exception as api_error:
+        logger.error("OpenAI API Error for replica %d: %s", i, api_error)
+        return {
+            "error": f"API Error: {str(api_error)}"
+        }, 0, 0
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     api_key_status = "configured" if os.getenv('OPENAI_API_KEY', '') else "not_configured"
@@ -454,7 +1248,7 @@ def test_json_parsing():
     
     try:
         cleaned_json = clean_openai_json_response(test_json)
-        parsed = json.loads(cleaned_json)
+        parsed = orjson.loads(cleaned_json)
         return jsonify({"success": True, "parsed": parsed})
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
@@ -479,10 +1273,24 @@ def reset_session_tokens_endpoint():
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
+@app.route('/api/reload-prompt', methods=['POST'])
+def reload_prompt_endpoint():
+    """Drop the cached prompt template so the next request re-reads it from disk"""
+    try:
+        load_prompt_template.cache_clear()
+        load_prompt_template()
+        return jsonify({
+            "success": True,
+            "message": "Prompt template reloaded successfully"
+        })
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
 @app.route('/api/token-history', methods=['GET'])
 def get_token_history():
     """Get token usage history from database"""
     try:
+        flush_token_usage()
         with get_db_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
@@ -508,459 +1316,158 @@ def generate_replicas():
     try:
         data = request.json
         
+        cache_policy = request.args.get('cache_policy', 'enabled')
+        if cache_policy not in CACHE_POLICIES:
+            return jsonify({"error": f"cache_policy must be one of {sorted(CACHE_POLICIES)}"}), 400
+        
         # Validate required fields
-        required_fields = ['question_text', 'short_text', 'solutions_metadata', 'test_cases', 'replica_type', 'num_replicas']
-        for field in required_fields:
-            if field not in data:
-                return jsonify({"error": f"Missing required field: {field}"}), 400
+        missing = _REQUIRED_FIELDS - data.keys()
+        if missing:
+            return jsonify({"error": f"Missing required fields: {sorted(missing)}"}), 400
         
         # Extract code from solutions_metadata
         solutions = data['solutions_metadata'][0] if data['solutions_metadata'] else {}
         code_details = solutions.get('code_details', [])
         
-        html_code = ""
-        css_code = ""
-        js_code = ""
-        
-        for code_detail in code_details:
-            if code_detail.get('language') == 'HTML':
-                html_code = code_detail.get('code_data', '')
-            elif code_detail.get('language') == 'CSS':
-                css_code = code_detail.get('code_data', '')
-            elif code_detail.get('language') == 'JAVASCRIPT':
-                js_code = code_detail.get('code_data', '')
+        code_by_language = {
+            code_detail.get('language'): code_detail.get('code_data', '')
+            for code_detail in code_details
+        }
+        html_code = code_by_language.get('HTML', '')
+        css_code = code_by_language.get('CSS', '')
+        js_code = code_by_language.get('JAVASCRIPT', '')
         
         # Format test cases
-        test_cases_text = ""
-        for test_case in data.get('test_cases', []):
-            test_cases_text += f"Test Case {test_case.get('order', '')}: {test_case.get('display_text', '')}\n"
-            test_cases_text += f"Criteria: {test_case.get('criteria', '')}\n\n"
+        test_cases_text = "".join(
+            f"Test Case {test_case.get('order', '')}: {test_case.get('display_text', '')}\n"
+            f"Criteria: {test_case.get('criteria', '')}\n\n"
+            for test_case in data.get('test_cases', [])
+        )
         
         # Load and format prompt template
         prompt_template = load_prompt_template()
         
-        # Replace placeholders in prompt
-        formatted_prompt = prompt_template.replace('{{original_html}}', html_code)
-        formatted_prompt = formatted_prompt.replace('{{original_css}}', css_code)
-        formatted_prompt = formatted_prompt.replace('{{original_js}}', js_code)
-        formatted_prompt = formatted_prompt.replace('{{short_description}}', data['short_text'])
-        formatted_prompt = formatted_prompt.replace('{{problem_statement}}', data['question_text'])
-        formatted_prompt = formatted_prompt.replace('{{test_scenarios}}', test_cases_text)
-        formatted_prompt = formatted_prompt.replace('{{N}}', str(data['num_replicas']))
-        
-        # Count input tokens
-        input_tokens = count_tokens(formatted_prompt)
+        # Replace placeholders in prompt in a single pass
+        substitutions = {
+            'original_html': html_code,
+            'original_css': css_code,
+            'original_js': js_code,
+            'short_description': data['short_text'],
+            'problem_statement': data['question_text'],
+            'test_scenarios': test_cases_text,
+            'N': str(data['num_replicas'])
+        }
+        formatted_prompt = _PLACEHOLDER_RE.sub(
+            lambda m: substitutions.get(m.group(1), m.group(0)), prompt_template
+        )
         
         # Call OpenAI API
         current_api_key = os.getenv('OPENAI_API_KEY', '')
         if not current_api_key:
-            print("ERROR: OpenAI API key not found in environment!")
+            logger.error("OpenAI API key not found in environment!")
             return jsonify({"error": "OpenAI API key not configured"}), 500
 
-        print(f"Making OpenAI API call with key: {current_api_key[:10]}...")
-
-        # Define diverse themes for each replica with context-specific content
-        themes = [
-  "Coffee Shop Manager", "Pizza Restaurant", "Bakery Counter", "Grocery Store",
-  "Bookstore Inventory", "Game Store", "Electronics Shop", "Fashion Boutique",
-  "Pet Store Manager", "Flower Shop", "Music Store", "Art Gallery",
-  "Sports Equipment", "Candy Store", "Toy Shop", "Pharmacy Counter",
-  "Hardware Store", "Car Rental", "Hotel Booking", "Travel Agency",
-  "Fitness Gym", "Restaurant Menu", "Library System", "Movie Theater",
-  "School Supplies", "Photography Studio", "Beauty Salon", "Laundromat",
-  "Ice Cream Parlor", "Juice Bar", "Bike Rental", "Camping Gear",
-  "Wedding Planner", "Food Truck", "Antique Shop", "Craft Store",
-  "Supermarket Chain", "Farmers Market", "Butcher Shop", "Seafood Market",
-  "Book Café", "Tattoo Studio", "Barbershop", "Nail Salon",
-  "Daycare Center", "E-learning Platform", "Music Academy", "Dance Studio",
-  "Driving School", "Language School", "Martial Arts Dojo", "Cooking Class",
-  "Event Venue", "Conference Center", "Coworking Space", "Startup Incubator",
-  "Real Estate Agency", "Property Rental", "Interior Design Studio", "Furniture Store",
-  "Home Decor Shop", "Lighting Store", "Appliance Store", "Mattress Shop",
-  "Garden Center", "Plant Nursery", "Organic Store", "Wine Shop",
-  "Brewery Taproom", "Sports Bar", "Nightclub Manager", "Concert Hall",
-  "Theater Playhouse", "Amusement Park", "Zoo Management", "Aquarium Center",
-  "Theme Park", "Arcade Center", "Escape Room", "Bowling Alley",
-  "Skating Rink", "Golf Course", "Tennis Club", "Soccer Academy",
-  "Hospital Management", "Clinic Reception", "Dental Office", "Veterinary Clinic",
-  "Pharmaceutical Store", "Optical Shop", "Hearing Aid Center", "Rehab Center",
-  "Courier Service", "Logistics Hub", "Airline Booking", "Shipping Company",
-  "Taxi Service", "Ride Sharing", "Parking Garage", "Fuel Station",
-  "Tech Repair Shop", "Mobile Store", "Laptop Store", "Watch Boutique",
-  "Jewelry Store", "Perfume Shop", "Handbag Boutique", "Shoe Store",
-  "Surf Shop", "Diving Center", "Ski Resort", "Snowboard Shop",
-  "Mountain Guide", "Hiking Supplies", "Fishing Store", "Hunting Shop",
-  "Board Game Café", "VR Arcade", "Esports Arena", "Streaming Studio",
-  "Podcast Studio", "Radio Station", "TV Channel Manager", "Film Production",
-  "Animation Studio", "Advertising Agency", "Consulting Firm", "HR Platform",
-  "Payroll Service", "Law Firm", "Notary Office", "Insurance Agency",
-  "Bank Branch", "Stock Brokerage", "Investment Firm", "Cryptocurrency Exchange",
-  "Charity Organization", "NGO Manager", "Volunteer Center", "Community Center",
-  "Religious Organization", "Church Management", "Mosque Administration", "Temple Management",
-  "Resort Manager", "Holiday Park", "Hostel Manager", "Bed and Breakfast",
-  "Vacation Rentals", "Timeshare Service", "RV Rental", "Yacht Rental",
-  "Cruise Line", "Train Service", "Metro Station", "Bus Depot",
-  "Trucking Company", "Warehousing Hub", "Cold Storage", "Freight Forwarding",
-  "Drone Delivery", "Postal Service", "Bike Courier", "Farmland Manager",
-  "Dairy Farm", "Poultry Farm", "Fishery Farm", "Aquaponics Farm",
-  "Greenhouse Farming", "Hydroponics Farm", "Crop Trading", "Fertilizer Shop",
-  "Seed Store", "Tractor Rental", "Mining Operations", "Oil Refinery",
-  "Solar Energy Plant", "Wind Farm", "Hydropower Plant", "Recycling Plant",
-  "Construction Firm", "Architecture Studio", "Cement Factory", "Steel Plant",
-  "Clothing Store", "Streetwear Shop", "Sports Apparel", "Tailor Shop",
-  "Textile Factory", "Leather Goods", "Accessories Store", "Cap Store",
-  "Restaurant Chain", "Buffet Restaurant", "Fine Dining", "Fast Food Outlet",
-  "Burger Joint", "Sandwich Shop", "Steakhouse", "Seafood Restaurant",
-  "Vegan Café", "Salad Bar", "Soup Kitchen", "Catering Service",
-  "Ramen Shop", "Sushi Bar", "Dim Sum Place", "Mexican Cantina",
-  "French Bistro", "Greek Taverna", "Turkish Kebab Shop", "Caribbean Restaurant",
-  "Cupcake Store", "Donut Shop", "Chocolate Boutique", "Crepe Stand",
-  "Pancake House", "Waffle Bar", "Coffee Roastery", "Bubble Tea Shop",
-  "Gaming Café", "Internet Café", "Makerspace", "Electronics Repair",
-  "Drone Store", "Smart Home Store", "AR Experience Center", "Tech Museum",
-  "Airport Duty Free", "Railway Station Shop", "Pop-Up Shop", "Music Festival Manager",
-  "Conference Organizer", "Sports League Manager", "Basketball Team", "Baseball Team",
-  "Football Club", "Olympics Committee", "Circus Show", "Comedy Club",
-  "Medical Research Lab", "Biotech Startup", "Pharma Manufacturing", "Health Insurance",
-  "Yoga Studio", "Meditation Center", "Spa Resort", "Ayurveda Clinic",
-  "News Agency", "Book Publisher", "Printing Press", "Stationery Shop",
-  "Souvenir Shop", "Gift Wrapping Service", "Party Supplies", "Costume Rental",
-  "Photo Booth", "DJ Service", "Karaoke Bar", "Open Mic Café",
-  "Software Company", "Web Design Agency", "Game Development Studio", "Cloud Hosting",
-  "Robotics Startup", "IoT Platform", "Blockchain Startup", "Metaverse Hub",
-  "Wildlife Sanctuary", "National Park", "Botanical Garden", "Heritage Site",
-  "Science Center", "Planetarium", "Space Observatory", "Rocket Launch Center",
-  "City Hall", "Post Office", "Police Department", "Fire Department",
-  "Ambulance Service", "Disaster Relief", "Customs Office", "Immigration Service",
-  "Military Base", "Airport Security", "Playground", "Water Park",
-  "Laser Tag Arena", "Go-Kart Track", "Horse Riding School", "Animal Shelter",
-  "Dog Grooming", "Cat Café",
-  "Elder Care Home", "Retirement Community", "Boarding School", "University Campus",
-  "Student Housing", "Scholarship Fund", "Exam Prep Center", "Research Institute",
-  "IT Training Center", "Coding Bootcamp", "Virtual Classroom", "MOOC Platform",
-  "Job Portal", "Freelance Marketplace", "Gig Economy Platform", "Remote Work Hub",
-  "Interior Landscaping", "Pool Maintenance", "Roofing Company", "Home Renovation",
-  "Carpentry Workshop", "Plumbing Services", "Electrical Services", "Solar Installer",
-  "Moving Company", "Cleaning Services", "Pest Control", "Security Services",
-  "CCTV Store", "Alarm Installation", "Locksmith Services", "Smart Security Hub",
-  "Baby Store", "Maternity Shop", "Toy Rental", "Kids Party Planner",
-  "Children’s Bookstore", "Comic Convention", "Cosplay Shop", "Boarding Kennel",
-  "Pet Daycare", "Pet Hotel", "Exotic Pet Store", "Aquarium Fish Shop",
-  "Bird Store", "Reptile Shop", "Pet Grooming School", "Dog Training Center",
-  "Organic Bakery", "Gluten-Free Store", "Keto Café", "Protein Bar",
-  "Smoothie Shop", "Vegan Market", "Ethnic Grocery", "Spice Shop",
-  "Olive Oil Shop", "Cheese Store", "Butcher Deli", "Farm-to-Table Restaurant",
-  "Artisan Coffee Roaster", "Craft Brewery", "Whiskey Distillery", "Gin Bar",
-  "Cigar Lounge", "Shisha Café", "Hookah Bar", "Wine Tasting Room",
-  "Luxury Spa", "Thermal Baths", "Hot Spring Resort", "Detox Center",
-  "Pilates Studio", "CrossFit Gym", "Boxing Club", "Climbing Gym",
-  "Skateboard Shop", "Roller Rink", "Parkour Gym", "Adventure Park",
-  "Drone Racing Arena", "RC Car Track", "Model Train Store", "LEGO Store",
-  "3D Printing Service", "Makers Lab", "Prototype Studio", "Electronics Lab",
-  "AR Gaming Arena", "Mixed Reality Studio", "Digital Art Gallery", "NFT Marketplace",
-  "Crypto Mining Farm", "Token Exchange", "DeFi Platform", "Metaverse Land Agency",
-  "Virtual Fashion Boutique", "VR Fitness Studio", "Online Casino", "Sports Betting",
-  "Horse Racing Track", "Dog Racing Arena", "Lottery Kiosk", "Bingo Hall",
-  "Community Radio", "Indie Film Studio", "Streaming Platform", "Music Label",
-  "Talent Scout", "Modeling Agency", "Casting Studio", "Script Writing Agency",
-  "Translation Service", "Subtitling Service", "Voiceover Studio", "Dubbing Studio",
-  "Content Creation Hub", "Influencer Agency", "Social Media Agency", "SEO Firm",
-  "Data Analytics Firm", "AI Consultancy", "ML Research Lab", "Cloud AI Service",
-  "Drone Photography", "Aerial Mapping", "Survey Company", "GIS Mapping",
-  "Real Estate Drone Tours", "Property Management", "Condominium Manager", "HOA Manager",
-  "Urban Planning Firm", "Smart City Platform", "Transport Authority", "Highway Management",
-  "Port Authority", "Shipyard", "Harbor Management", "Fisherman’s Wharf",
-  "Luxury Car Dealer", "Used Car Dealer", "Motorcycle Shop", "Scooter Rental",
-  "EV Charging Station", "EV Rental", "Battery Swap Station", "Green Energy Store",
-  "Charcoal Shop", "BBQ Supplies", "Kitchen Equipment Store", "Cooking Oil Shop",
-  "Packaging Supplies", "Paper Mill", "Printing Ink Store", "Label Printing",
-  "Advertising Print Shop", "Merchandise Store", "Souvenir Kiosk", "Festival Booth",
-  "Holiday Decor Store", "Halloween Shop", "Christmas Market", "Fireworks Stand",
-  "Gift Basket Store", "Luxury Gifting Service", "Diamond Store", "Gemstone Boutique",
-  "Goldsmith", "Silversmith", "Engraving Shop", "Watch Customization",
-  "Vintage Car Rental", "Classic Car Restoration", "Motor Garage", "Auto Parts Shop",
-  "Tire Shop", "Car Wash", "Detailing Center", "Tow Truck Service",
-  "Scrapyard", "Metal Recycling", "E-waste Recycling", "Battery Recycling",
-  "Eco-Friendly Products", "Zero Waste Store", "Thrift Shop", "Second-Hand Store",
-  "Pawn Broker", "Consignment Store", "Auction House", "Art Auction",
-  "Collector’s Shop", "Stamp Shop", "Coin Shop", "Antique Bookstore",
-  "Rare Vinyl Store", "Vintage Clothing Shop", "Retro Arcade", "Classic Game Shop"
-]
-        # Shuffle themes to avoid predictable patterns across multiple generations
-        import random
-        shuffled_themes = themes.copy()
-        random.shuffle(shuffled_themes)
-        
-        # For now, let's generate replicas one at a time to avoid JSON parsing issues
+        logger.debug("Making OpenAI API call with key: %s...", current_api_key[:10])
+
+        # Generate each replica with its own request to avoid JSON parsing issues
         num_replicas = int(data['num_replicas'])
-        all_replicas = {}
-        total_output_tokens = 0
+        
+        # Pick distinct themes and color schemes up front (they only repeat past the table size)
+        theme_indices = random.sample(range(len(THEMES)), min(num_replicas, len(THEMES)))
+        replica_colors = random.sample(COLOR_SCHEMES, min(num_replicas, len(COLOR_SCHEMES)))
+        replica_messages = []
+        
+        # Metadata is the same for every replica, so it is sent once as "meta" rather than copied
+        # into each replica (the frontend merges it back); explicit request fields win over tag_names
+        tag_names = data.get('tag_names', [])
+        replica_meta = {
+            field: data.get(field) or extract_tag_value(tag_names, prefix)
+            for field, prefix in REPLICA_TAG_PREFIXES
+        }
+        
+        # A replica is about as long as the original it rewrites, so cap generation near that
+        # size (with headroom for the themed rewrite) instead of always reserving the maximum
+        original_size = count_tokens(html_code + css_code + js_code + data['question_text'] + test_cases_text)
+        max_tokens = min(OPENAI_MAX_TOKENS, 400 + 2 * original_size)
+        
+        # Format test cases using original test case data
+        original_test_cases = data.get('test_cases', [])
+        formatted_test_cases = format_test_cases_from_original(original_test_cases, len(original_test_cases))
+        
+        # The original content is the same for every replica; only the theme and colors differ
+        single_replica_prompt = formatted_prompt.replace(f'**{num_replicas}**', '**1**').replace(
+            'Generate **{N}** replicas', 'Generate **1** replica'
+        )
         
         for i in range(1, num_replicas + 1):
             # Get a unique theme for this replica
-            theme_index = (i - 1) % len(shuffled_themes)
-            selected_theme = shuffled_themes[theme_index]
-            theme_suffix = selected_theme.lower().replace(' ', '-').replace('store', '').replace('shop', '').replace('manager', '').strip('-')
+            theme_index = theme_indices[(i - 1) % len(theme_indices)]
+            selected_theme = THEMES[theme_index]
+            theme_suffix = THEME_SUFFIXES[theme_index]
             
-            # Create a prompt for just one replica with specific theme
-            single_replica_prompt = formatted_prompt.replace(f'**{num_replicas}**', '**1**')
-            single_replica_prompt = single_replica_prompt.replace('Generate **{N}** replicas', 'Generate **1** replica')
+            # Get unique color scheme for this replica
+            selected_colors = replica_colors[(i - 1) % len(replica_colors)]
             
-            try:
-                # Define extensive unique color schemes for each replica
-                color_schemes = [
-                    {"primary": "#FF6B6B", "secondary": "#4ECDC4", "accent": "#45B7D1", "background": "#F8F9FA", "text": "#2C3E50"},  # Coral & Teal
-                    {"primary": "#6C5CE7", "secondary": "#FD79A8", "accent": "#FDCB6E", "background": "#DDD6FE", "text": "#2D3748"},  # Purple & Pink
-                    {"primary": "#00B894", "secondary": "#FF7675", "accent": "#74B9FF", "background": "#F0FDF4", "text": "#1A202C"},  # Green & Red
-                    {"primary": "#E17055", "secondary": "#81ECEC", "accent": "#A29BFE", "background": "#FFF5F5", "text": "#2C5282"},  # Orange & Cyan
-                    {"primary": "#00CEC9", "secondary": "#FDCB6E", "accent": "#E84393", "background": "#F0FDFA", "text": "#1A365D"},  # Turquoise & Yellow
-                    {"primary": "#6C5CE7", "secondary": "#00B894", "accent": "#FF7675", "background": "#EDF2F7", "text": "#2D3748"},  # Purple & Green
-                    {"primary": "#FD79A8", "secondary": "#74B9FF", "accent": "#FDCB6E", "background": "#FFF0F6", "text": "#1A202C"},  # Pink & Blue
-                    {"primary": "#00B894", "secondary": "#E17055", "accent": "#A29BFE", "background": "#F7FAFC", "text": "#2C5282"},  # Mint & Orange
-                    {"primary": "#FF7675", "secondary": "#81ECEC", "accent": "#FDCB6E", "background": "#FFFAF0", "text": "#1A365D"},  # Red & Aqua
-                    {"primary": "#A29BFE", "secondary": "#55A3FF", "accent": "#FD79A8", "background": "#F8FAFC", "text": "#2D3748"},  # Lavender & Sky Blue
-                    {"primary": "#FF9F43", "secondary": "#70A1FF", "accent": "#5F27CD", "background": "#FFF8E1", "text": "#1A202C"},  # Orange & Periwinkle
-                    {"primary": "#1DD1A1", "secondary": "#FF6B6B", "accent": "#3742FA", "background": "#F0FFF4", "text": "#2C5282"},  # Seafoam & Coral
-                    {"primary": "#FF3838", "secondary": "#2ECC71", "accent": "#F39C12", "background": "#FEF5E7", "text": "#1A365D"},  # Bright Red & Emerald
-                    {"primary": "#8E44AD", "secondary": "#1ABC9C", "accent": "#E67E22", "background": "#F4F1FF", "text": "#2D3748"},  # Violet & Turquoise
-                    {"primary": "#E74C3C", "secondary": "#3498DB", "accent": "#F1C40F", "background": "#FDF2F8", "text": "#1A202C"},  # Crimson & Dodger Blue
-                    {"primary": "#9B59B6", "secondary": "#16A085", "accent": "#D35400", "background": "#FAF5FF", "text": "#2C5282"},  # Amethyst & Teal
-                    {"primary": "#27AE60", "secondary": "#E91E63", "accent": "#FF9800", "background": "#F7FDF0", "text": "#1A365D"},  # Forest Green & Pink
-                    {"primary": "#3F51B5", "secondary": "#4CAF50", "accent": "#FF5722", "background": "#F3F4FF", "text": "#2D3748"},  # Indigo & Green
-                    {"primary": "#673AB7", "secondary": "#009688", "accent": "#FFC107", "background": "#F8F5FF", "text": "#1A202C"},  # Deep Purple & Teal
-                    {"primary": "#795548", "secondary": "#2196F3", "accent": "#FF4081", "background": "#F5F5DC", "text": "#2C5282"},  # Brown & Blue
-                    {"primary": "#DC143C", "secondary": "#20B2AA", "accent": "#FFD700", "background": "#FFF8DC", "text": "#191970"},  # Crimson & Light Sea Green
-                    {"primary": "#FF1493", "secondary": "#00CED1", "accent": "#32CD32", "background": "#F0F8FF", "text": "#4B0082"},  # Deep Pink & Dark Turquoise
-                    {"primary": "#8B008B", "secondary": "#FF8C00", "accent": "#00FA9A", "background": "#F5FFFA", "text": "#2F4F4F"},  # Dark Magenta & Dark Orange
-                    {"primary": "#B22222", "secondary": "#48D1CC", "accent": "#9ACD32", "background": "#FFFAFA", "text": "#556B2F"},  # Fire Brick & Medium Turquoise
-                    {"primary": "#4169E1", "secondary": "#FF6347", "accent": "#9370DB", "background": "#F0F0F0", "text": "#8B4513"},  # Royal Blue & Tomato
-                    {"primary": "#228B22", "secondary": "#DA70D6", "accent": "#FFA500", "background": "#F5F5F5", "text": "#800000"},  # Forest Green & Orchid
-                    {"primary": "#FF4500", "secondary": "#7B68EE", "accent": "#20B2AA", "background": "#FAFAFA", "text": "#2E8B57"},  # Orange Red & Medium Slate Blue
-                    {"primary": "#8A2BE2", "secondary": "#00FF7F", "accent": "#FF69B4", "background": "#F8F8FF", "text": "#8B0000"},  # Blue Violet & Spring Green
-                    {"primary": "#CD5C5C", "secondary": "#40E0D0", "accent": "#FFDAB9", "background": "#FDF5E6", "text": "#6B8E23"},  # Indian Red & Turquoise
-                    {"primary": "#1E90FF", "secondary": "#FFB6C1", "accent": "#98FB98", "background": "#F0FFFF", "text": "#A0522D"},  # Dodger Blue & Light Pink
-                    {"primary": "#32CD32", "secondary": "#FF1493", "accent": "#87CEEB", "background": "#FFFACD", "text": "#8B008B"},  # Lime Green & Deep Pink
-                    {"primary": "#FF8C00", "secondary": "#4682B4", "accent": "#DDA0DD", "background": "#FFF0F5", "text": "#006400"},  # Dark Orange & Steel Blue
-                    {"primary": "#9932CC", "secondary": "#FF7F50", "accent": "#7FFFD4", "background": "#F5FFFA", "text": "#B22222"},  # Dark Orchid & Coral
-                    {"primary": "#FF69B4", "secondary": "#2E8B57", "accent": "#F0E68C", "background": "#F8F8FF", "text": "#4B0082"},  # Hot Pink & Sea Green
-                    {"primary": "#DC143C", "secondary": "#00BFFF", "accent": "#ADFF2F", "background": "#FFFAF0", "text": "#8B4513"},  # Crimson & Deep Sky Blue
-                    {"primary": "#8B0000", "secondary": "#00FFFF", "accent": "#FFE4B5", "background": "#FFF5EE", "text": "#2F4F4F"},  # Dark Red & Cyan
-                    {"primary": "#4B0082", "secondary": "#FF6347", "accent": "#98FB98", "background": "#F0F8FF", "text": "#8B4513"},  # Indigo & Tomato
-                    {"primary": "#006400", "secondary": "#FF1493", "accent": "#F0E68C", "background": "#FFFACD", "text": "#8B008B"},  # Dark Green & Deep Pink
-                    {"primary": "#FF4500", "secondary": "#4169E1", "accent": "#DDA0DD", "background": "#FFF8DC", "text": "#2E8B57"},  # Orange Red & Royal Blue
-                    {"primary": "#8B008B", "secondary": "#32CD32", "accent": "#FFB6C1", "background": "#F5F5DC", "text": "#800000"},  # Dark Magenta & Lime Green
-                    {"primary": "#B22222", "secondary": "#00CED1", "accent": "#FFDAB9", "background": "#F0FFFF", "text": "#556B2F"},  # Fire Brick & Dark Turquoise
-                    {"primary": "#9370DB", "secondary": "#FF8C00", "accent": "#87CEEB", "background": "#F8F8FF", "text": "#A0522D"},  # Medium Purple & Dark Orange
-                    {"primary": "#20B2AA", "secondary": "#DC143C", "accent": "#F5DEB3", "background": "#FFFAFA", "text": "#8B0000"},  # Light Sea Green & Crimson
-                    {"primary": "#FF6347", "secondary": "#4B0082", "accent": "#E0FFFF", "background": "#FDF5E6", "text": "#2F4F4F"},  # Tomato & Indigo
-                    {"primary": "#00FA9A", "secondary": "#8B008B", "accent": "#FFEFD5", "background": "#F5FFFA", "text": "#B22222"},  # Medium Spring Green & Dark Magenta
-                    {"primary": "#7B68EE", "secondary": "#FF4500", "accent": "#F0F8FF", "background": "#FAFAFA", "text": "#2E8B57"},  # Medium Slate Blue & Orange Red
-                    {"primary": "#FF69B4", "secondary": "#228B22", "accent": "#FFE4E1", "background": "#F0F0F0", "text": "#8B4513"},  # Hot Pink & Forest Green
-                    {"primary": "#4682B4", "secondary": "#FF8C00", "accent": "#F5FFFA", "background": "#FFF5EE", "text": "#006400"},  # Steel Blue & Dark Orange
-                    {"primary": "#2E8B57", "secondary": "#FF69B4", "accent": "#FFF8DC", "background": "#F8F8FF", "text": "#4B0082"},  # Sea Green & Hot Pink
-                    {"primary": "#00BFFF", "secondary": "#DC143C", "accent": "#FFFACD", "background": "#F0FFFF", "text": "#8B0000"},  # Deep Sky Blue & Crimson
-                    {"primary": "#FF7F50", "secondary": "#9932CC", "accent": "#E6E6FA", "background": "#FFF0F5", "text": "#2F4F4F"},  # Coral & Dark Orchid
-                ]
-                
-                # Shuffle color schemes to ensure randomness
-                random.shuffle(color_schemes)
-                
-                # Get unique color scheme for this replica
-                color_index = (i - 1) % len(color_schemes)
-                selected_colors = color_schemes[color_index]
-                
-                # Use a structured text format instead of JSON to avoid parsing issues
-                structured_prompt = f"""
-Create a web coding replica with the following format:
-
-THEME: {selected_theme}
-HTML_START
-[complete HTML code with unique IDs based on theme "{theme_suffix}"]
-HTML_END
-CSS_START
-[complete CSS code with matching selectors and MANDATORY color scheme]  
-CSS_END
-JS_START
-[complete JavaScript code with matching getElementById calls]
-JS_END
-QUESTION_START
-[modified question text with new theme context for "{selected_theme}"]
-QUESTION_END
-TESTS_START
-[test cases separated by newlines, adapted for "{selected_theme}" context]
-TESTS_END
-
-CRITICAL REQUIREMENTS FOR "{selected_theme}" THEME:
-1. Use theme suffix "{theme_suffix}" in ALL IDs (e.g., calculate-{theme_suffix}, total-{theme_suffix})
-2. Transform ALL text content to match "{selected_theme}" context
-3. Change labels, headings, and descriptions to fit the theme
-4. ALL HTML IDs must match ALL JavaScript getElementById calls exactly
-5. Make the UI text contextually relevant to "{selected_theme}"
-
-MANDATORY COLOR SCHEME (USE THESE EXACT COLORS):
-- Primary Color: {selected_colors['primary']} (buttons, headers, main elements)
-- Secondary Color: {selected_colors['secondary']} (accents, borders, highlights)
-- Accent Color: {selected_colors['accent']} (hover states, active elements)
-- Background Color: {selected_colors['background']} (main background)
-- Text Color: {selected_colors['text']} (all text content)
-
-COLOR USAGE RULES:
-- NO white (#FFFFFF) or black (#000000) backgrounds
-- Use the provided colors EXACTLY as specified
-- Apply gradients using primary and secondary colors: linear-gradient({selected_colors['primary']}, {selected_colors['secondary']})
-- Use accent color for interactive elements (hover, focus, active states)
-- Ensure good contrast for readability
-- Apply shadow effects using rgba versions of the colors
-- Use color variations (lighter/darker shades) for depth
-
-REQUIRED CSS STYLING EXAMPLES:
-body {{ background-color: {selected_colors['background']}; color: {selected_colors['text']}; }}
-.button-primary {{ background-color: {selected_colors['primary']}; border: 2px solid {selected_colors['secondary']}; }}
-.button-primary:hover {{ background-color: {selected_colors['accent']}; }}
-.header {{ background: linear-gradient(135deg, {selected_colors['primary']}, {selected_colors['secondary']}); }}
-.card {{ background-color: {selected_colors['background']}; border: 1px solid {selected_colors['secondary']}; box-shadow: 0 4px 8px rgba(0,0,0,0.1); }}
-
-Example transformations for "{selected_theme}":
-- Original: "Calculate Total" -> New: "Calculate {selected_theme} Total"
-- Original: id="calculate" -> New: id="calculate-{theme_suffix}"
-- Original: "Items" -> New: contextual items for {selected_theme}
-- Original: getElementById('total') -> New: getElementById('total-{theme_suffix}')
-
-Original content to transform:
-{single_replica_prompt}
-
-Generate exactly ONE replica with "{selected_theme}" theme, consistent ID naming using "{theme_suffix}" suffix, and the EXACT color scheme provided above.
-"""
-                
-                response = openai.ChatCompletion.create(
-                    model="gpt-3.5-turbo",
-                    messages=[
-                        {"role": "system", "content": f"""You are a web developer who creates themed code replicas with completely unique contexts and vibrant color schemes.
-
-MANDATORY REQUIREMENTS FOR "{selected_theme}" THEME:
-1. Transform ALL text content to match "{selected_theme}" context exactly
-2. Use ONLY IDs with "{theme_suffix}" suffix (e.g., 'calculate-{theme_suffix}', 'total-{theme_suffix}')
-3. ALL HTML element IDs must use the "{theme_suffix}" suffix consistently  
-4. ALL JavaScript getElementById calls must match HTML IDs exactly
-5. Replace ALL labels, headings, and UI text to fit "{selected_theme}" context
-6. Make the entire interface contextually relevant to "{selected_theme}"
-
-CRITICAL COLOR REQUIREMENTS:
-- Primary: {selected_colors['primary']} - Use for main buttons, headers, important elements
-- Secondary: {selected_colors['secondary']} - Use for accents, borders, secondary buttons
-- Accent: {selected_colors['accent']} - Use for hover effects, active states, highlights
-- Background: {selected_colors['background']} - Use for main background areas
-- Text: {selected_colors['text']} - Use for all text content
-
-FORBIDDEN COLORS:
-- NO white (#FFFFFF, #FFF, white) backgrounds
-- NO black (#000000, #000, black) backgrounds  
-- NO gray (#808080, gray) as primary colors
-- MUST use the provided colors EXACTLY
-
-CSS COLOR IMPLEMENTATION:
-- background-color: {selected_colors['background']};
-- color: {selected_colors['text']};
-- Button primary: background-color: {selected_colors['primary']};
-- Button secondary: background-color: {selected_colors['secondary']};
-- Hover effects: background-color: {selected_colors['accent']};
-- Apply gradients combining primary and secondary colors
-
-CONTENT TRANSFORMATION RULES:
-- Change "Calculate" to "Calculate for {selected_theme}"
-- Change "Items" to contextual items (e.g., "Products", "Books", "Coffees")
-- Change "Total" to "{selected_theme} Total" 
-- Adapt all text to be meaningful in "{selected_theme}" context
-
-ID CONSISTENCY RULES:
-- HTML: id="calculate-{theme_suffix}"
-- JavaScript: getElementById('calculate-{theme_suffix}')
-- NO generic IDs, ALL must use "{theme_suffix}" suffix
-
-Use the THEME/HTML_START/HTML_END format exactly. Do not use JSON. Make this replica completely unique with "{selected_theme}" context and vibrant colors."""},
-                        {"role": "user", "content": structured_prompt}
-                    ],
-                    max_tokens=2500,
-                    temperature=0.7
-                )
-                
-                # Parse this single replica
-                response_content = response.choices[0].message.content
-                total_output_tokens += count_tokens(response_content)
-                
-                print(f"Replica {i} response length: {len(response_content)}")
-                
-                try:
-                    # Parse the structured text response
-                    replica_data = parse_structured_response(response_content)
-                    
-                    if replica_data:
-                        # Format test cases using original test case data
-                        original_test_cases = data.get('test_cases', [])
-                        formatted_test_cases = format_test_cases_from_original(original_test_cases, len(original_test_cases))
-                        
-                        # Replace text test cases with structured format
-                        replica_data['test_cases'] = formatted_test_cases
-                        
-                        # Add additional metadata
-                        replica_data.update({
-                            'subtopic': extract_tag_value(data.get('tag_names', []), 'SUB_TOPIC_'),
-                            'course': extract_tag_value(data.get('tag_names', []), 'COURSE_'),
-                            'module': extract_tag_value(data.get('tag_names', []), 'MODULE_'),
-                            'unit': extract_tag_value(data.get('tag_names', []), 'UNIT_')
-                        })
-                        
-                        all_replicas[f'replica_{i}'] = replica_data
-                        print(f"Successfully generated replica {i}")
-                    else:
-                        all_replicas[f'replica_{i}'] = {
-                            "error": f"Failed to parse structured response for replica {i}",
-                            "raw_response": response_content[:500]
-                        }
-                    
-                except Exception as e:
-                    print(f"Parsing error for replica {i}: {str(e)}")
-                    all_replicas[f'replica_{i}'] = {
-                        "error": f"Failed to parse replica {i}: {str(e)}",
-                        "raw_response": response_content[:500]
-                    }
-                
-            except Exception as api_error:
-                print(f"OpenAI API Error for replica {i}: {str(api_error)}")
-                all_replicas[f'replica_{i}'] = {
-                    "error": f"API Error: {str(api_error)}"
-                }
+            # Use a structured text format instead of JSON to avoid parsing issues
+            structured_prompt = USER_PROMPT_TEMPLATE.format(
+                theme=selected_theme,
+                theme_suffix=theme_suffix,
+                original_content=single_replica_prompt,
+                **selected_colors
+            )
+            
+            # Every replica shares the one system message; only the user message is built per replica
+            replica_messages.append([SYSTEM_MESSAGE, {"role": "user", "content": structured_prompt}])
+        
+        # The rate limiter needs each call's prompt size up front; replica prompts differ only in
+        # their short theme/color assignment, so tokenize one instead of every replica's copy.
+        # Without the limiter the stream's usage chunk reports the real counts, so skip it
+        prompt_tokens = None
+        if _rate_limiter.enabled and replica_messages:
+            prompt_tokens = count_message_tokens(replica_messages[0])
+        
+        if cache_policy == 'disabled':
+            cache_keys = repeat(None)
+        else:
+            cache_keys = response_cache_keys(
+                single_replica_prompt, OPENAI_MODEL, REPLICA_TEMPERATURE, max_tokens, num_replicas
+            )
+        
+        # Fan the OpenAI calls out so their network waits overlap; map yields results in replica order
+        replica_results = list(_replica_executor.map(
+            generate_single_replica,
+            range(1, num_replicas + 1),
+            replica_messages,
+            repeat(max_tokens),
+            repeat(formatted_test_cases),
+            repeat(cache_policy),
+            repeat(prompt_tokens),
+            cache_keys
+        ))
+        
+        all_replicas = {
+            f'replica_{i}': replica_data
+            for i, (replica_data, _, _) in enumerate(replica_results, start=1)
+        }
+        # Failed calls report zero tokens, so the usage sums need no error handling
+        total_input_tokens = sum(input_tokens for _, input_tokens, _ in replica_results)
+        total_output_tokens = sum(output_tokens for _, _, output_tokens in replica_results)
 
         # Calculate total tokens
-        total_request_tokens = input_tokens + total_output_tokens
+        total_request_tokens = total_input_tokens + total_output_tokens
 
         # Update token tracking in database
-        update_token_usage(total_request_tokens, total_request_tokens)
-        current_usage = get_token_usage()
+        current_usage = update_token_usage(total_request_tokens, total_request_tokens)
 
         # Set generated_replicas to our collected replicas
         generated_replicas = all_replicas
         
-        # Add metadata to each replica
-        subtopic = data.get('subtopic', '')
-        course = data.get('course', '')
-        module = data.get('module', '')
-        unit = data.get('unit', '')
-        
-        for replica_key in generated_replicas:
-            if isinstance(generated_replicas[replica_key], dict):
-                generated_replicas[replica_key].update({
-                    'subtopic': subtopic,
-                    'course': course,
-                    'module': module,
-                    'unit': unit
-                })
-        
         return jsonify({
             "success": True,
             "replicas": generated_replicas,
+            "meta": replica_meta,
             "token_usage": {
-                "input_tokens": input_tokens,
+                "input_tokens": total_input_tokens,
                 "output_tokens": total_output_tokens,
                 "total_tokens": total_request_tokens
             },
@@ -970,14 +1477,35 @@ Use the THEME/HTML_START/HTML_END format exactly. Do not use JSON. Make this rep
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+# Excel export layout: column header and the replica field that fills it
+EXCEL_COLUMNS = (
+    ('Short_Text', 'short_text'),
+    ('HTML_Code', 'html_code'),
+    ('CSS_Code', 'css_code'),
+    ('Js_Code', 'js_code'),
+    ('Question_text', 'question_text'),
+    ('Test_cases', 'test_cases'),
+    ('HTML_Solution', 'html_solution'),
+    ('CSS_Solution', 'css_solution'),
+    ('JS_Solution', 'js_solution'),
+    ('Subtopic', 'subtopic'),
+    ('Course', 'course'),
+    ('Module', 'module'),
+    ('Unit', 'unit'),
+)
+EXCEL_HEADERS = tuple(header for header, _ in EXCEL_COLUMNS)
+EXCEL_KEYS = tuple(key for _, key in EXCEL_COLUMNS)
+
 @app.route('/api/download-excel', methods=['POST'])
 def download_excel():
     try:
         data = request.json
         replicas = data.get('replicas', {})
         
-        # Prepare data for Excel
-        excel_data = []
+        # Stream rows straight into a write-only workbook instead of going through a DataFrame
+        workbook = Workbook(write_only=True)
+        worksheet = workbook.create_sheet('Replicas')
+        worksheet.append(EXCEL_HEADERS)
         
         for replica_key, replica_data in replicas.items():
             if isinstance(replica_data, dict):
@@ -985,44 +1513,39 @@ def download_excel():
                 test_cases_str = ""
                 if isinstance(replica_data.get('test_cases'), list):
                     # Convert structured test cases to JSON string
-                    test_cases_str = json.dumps(replica_data.get('test_cases', []), indent=2)
+                    test_cases_str = orjson.dumps(
+                        replica_data.get('test_cases', []), option=orjson.OPT_INDENT_2
+                    ).decode('utf-8')
                 elif isinstance(replica_data.get('test_cases'), str):
                     test_cases_str = replica_data.get('test_cases', '')
                 else:
                     test_cases_str = str(replica_data.get('test_cases', ''))
                 
-                excel_data.append({
-                    'Short_Text': replica_data.get('short_text', ''),
-                    'HTML_Code': replica_data.get('html_code', ''),
-                    'CSS_Code': replica_data.get('css_code', ''),
-                    'Js_Code': replica_data.get('js_code', ''),
-                    'Question_text': replica_data.get('question_text', ''),
-                    'Test_cases': test_cases_str,
-                    'HTML_Solution': replica_data.get('html_solution', ''),
-                    'CSS_Solution': replica_data.get('css_solution', ''),
-                    'JS_Solution': replica_data.get('js_solution', ''),
-                    'Subtopic': replica_data.get('subtopic', ''),
-                    'Course': replica_data.get('course', ''),
-                    'Module': replica_data.get('module', ''),
-                    'Unit': replica_data.get('unit', '')
-                })
+                worksheet.append(tuple(
+                    test_cases_str if key == 'test_cases' else replica_data.get(key, '')
+                    for key in EXCEL_KEYS
+                ))
         
-        # Create DataFrame and Excel file
-        df = pd.DataFrame(excel_data)
-        
-        # Create Excel file in memory
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, sheet_name='Replicas', index=False)
-        
-        output.seek(0)
+        # Spool the workbook to an anonymous temporary file rather than memory, so large exports
+        # stream from disk; the OS deletes the file when the response closes it
+        output = tempfile.TemporaryFile(suffix='.xlsx')
+        try:
+            workbook.save(output)
+            size = output.tell()
+            output.seek(0)
+        except Exception:
+            output.close()
+            raise
         
-        return send_file(
+        response = send_file(
             output,
             mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
             as_attachment=True,
             download_name=f'web_coding_replicas_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
         )
+        # send_file can't size an unnamed file, so keep the Content-Length the in-memory version had
+        response.content_length = size
+        return response
         
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -1032,23 +1555,28 @@ def download_json():
     try:
         data = request.json
         
-        # Create JSON file in memory
-        output = io.StringIO()
-        json.dump(data, output, indent=2)
-        output.seek(0)
+        # Create JSON file in memory (orjson emits UTF-8 bytes directly)
+        payload = orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
         
-        # Convert to bytes
-        json_bytes = io.BytesIO(output.getvalue().encode('utf-8'))
+        # The replica code is highly repetitive text, so gzip it when the client accepts it
+        use_gzip = 'gzip' in request.accept_encodings
+        if use_gzip:
+            payload = gzip.compress(payload, compresslevel=6)
         
-        return send_file(
-            json_bytes,
+        response = send_file(
+            io.BytesIO(payload),
             mimetype='application/json',
             as_attachment=True,
             download_name=f'web_coding_replicas_{datetime.now().strftime("%Y%m%d_%H%M%S")}.json'
         )
+        response.headers['Vary'] = 'Accept-Encoding'
+        if use_gzip:
+            response.headers['Content-Encoding'] = 'gzip'
+        return response
         
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    # Development server only; production runs under gunicorn (see gunicorn.conf.py)
+    app.run(debug=os.getenv('FLASK_DEBUG', 'False').lower() in ('1', 'true'), host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,16 @@
+# Gunicorn settings for production (see DEPLOYMENT.md); used by the Procfile
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+
+# gevent workers keep many slow OpenAI requests in flight per process
+worker_class = 'gevent'
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+# Workers inherit this, so the app can split the account-wide OpenAI rate limits between them
+os.environ['WEB_CONCURRENCY'] = str(workers)
+worker_connections = int(os.getenv('WORKER_CONNECTIONS', '1000'))
+
+# Replica generation can take well over gunicorn's 30s default
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '180'))
+keepalive = 5
@@ -1,29 +1,42 @@
 from flask import Flask, request, jsonify, send_file
 from flask_cors import CORS
+from openpyxl import Workbook
 import openai
-import json
-import pandas as pd
+import requests
+import orjson
 import io
 import os
+import random
+import re
+import threading
+import time
+import logging
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from itertools import repeat
 from datetime import datetime
 import uuid
-from langchain.llms import OpenAI
-from langchain.prompts import PromptTemplate
-from langchain.chains import LLMChain
 import tiktoken
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
 load_dotenv()
 
+logging.basicConfig(
+    level=os.getenv('LOG_LEVEL', 'INFO').upper(),
+    format='%(asctime)s %(levelname)s %(name)s: %(message)s'
+)
+logger = logging.getLogger(__name__)
+
 app = Flask(__name__)
 CORS(app)
 
-# Token tracking
+# Token tracking (guarded by _token_usage_lock; requests may run on several threads)
 token_usage = {
     'session_tokens': 0,
     'total_tokens': 0
 }
+_token_usage_lock = threading.Lock()
 
 # Load OpenAI API key from environment
 openai_api_key = os.getenv('OPENAI_API_KEY', '')
@@ -31,24 +44,66 @@ openai.api_key = openai_api_key
 
 # Validate API key on startup
 if not openai_api_key:
-    print("WARNING: OpenAI API key not found! Please check your .env file.")
-    print("Make sure you have a .env file with OPENAI_API_KEY=your_key_here")
+    logger.warning("OpenAI API key not found! Please check your .env file.")
+    logger.warning("Make sure you have a .env file with OPENAI_API_KEY=your_key_here")
 else:
-    print(f"✅ OpenAI API key loaded: {openai_api_key[:10]}...{openai_api_key[-10:]}")
+    logger.info("OpenAI API key loaded: %s...%s", openai_api_key[:10], openai_api_key[-10:])
+
+# Loaded tiktoken encodings by model; a failed load is retried after ENCODING_RETRY_SECONDS
+ENCODING_RETRY_SECONDS = 60
+_encodings = {}
+_encoding_retry_at = {}
+
+def _get_encoding(model):
+    """Load the tiktoken encoding for a model once and reuse it; None while it can't be loaded"""
+    encoding = _encodings.get(model)
+    if encoding is not None:
+        return encoding
+    if time.monotonic() < _encoding_retry_at.get(model, 0):
+        return None
+    try:
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            # Unknown model name - fall back to the chat models' encoding
+            encoding = tiktoken.get_encoding("cl100k_base")
+    except (requests.RequestException, OSError, ValueError) as e:
+        # The encoding file could not be downloaded or read; estimate from length until the
+        # retry window passes instead of retrying the download on every count
+        logger.warning("Could not load tiktoken encoding for %s, estimating token counts: %s", model, e)
+        _encoding_retry_at[model] = time.monotonic() + ENCODING_RETRY_SECONDS
+        return None
+    _encodings[model] = encoding
+    return encoding
 
 def count_tokens(text, model="gpt-3.5-turbo"):
     """Count tokens in text using tiktoken"""
-    try:
-        encoding = tiktoken.encoding_for_model(model)
-        return len(encoding.encode(text))
-    except:
-        # Fallback estimation
-        return len(text.split()) * 1.3
+    if not text:
+        return 0
+    encoding = _get_encoding(model)
+    if encoding is None:
+        # Fallback estimation (~4 characters per token)
+        return (len(text) + 3) // 4
+    # encode_ordinary treats special-token text as plain text instead of raising
+    return len(encoding.encode_ordinary(text))
+
+# Regexes used while cleaning/repairing JSON and parsing structured responses,
+# compiled once at import instead of on every call
+_NL_IN_STR_RE = re.compile(r'(?<!\\)\n(?=.*"[^"]*$)')
+_UNESCAPED_QUOTES_RE = re.compile(r'(:\s*")([^"]*)"([^"]*)"([^"]*)"')
+_TRAILING_COMMA_RE = re.compile(r',(\s*[}\]])')
+_MISSING_COMMA_RE = re.compile(r'}(\s*)"')
+
+_THEME_RE = re.compile(r'THEME:\s*(.+)')
+_REPLICA_SUFFIX_RE = re.compile(r'\s*-?\s*Replica\s*\d*\s*', re.IGNORECASE)
+_HTML_RE = re.compile(r'HTML_START\s*(.*?)\s*HTML_END', re.DOTALL)
+_CSS_RE = re.compile(r'CSS_START\s*(.*?)\s*CSS_END', re.DOTALL)
+_JS_RE = re.compile(r'JS_START\s*(.*?)\s*JS_END', re.DOTALL)
+_QUESTION_RE = re.compile(r'QUESTION_START\s*(.*?)\s*QUESTION_END', re.DOTALL)
+_TESTS_RE = re.compile(r'TESTS_START\s*(.*?)\s*TESTS_END', re.DOTALL)
 
 def clean_openai_json_response(response_text):
     """Clean and fix common JSON issues in OpenAI responses"""
-    import re
-    
     # Remove markdown code blocks
     cleaned = response_text.strip()
     if cleaned.startswith('```json'):
@@ -73,72 +128,53 @@ def clean_openai_json_response(response_text):
     # This is a simple approach - we'll try to parse as-is first
     try:
         # Test if it parses correctly
-        json.loads(json_content)
+        orjson.loads(json_content)
         return json_content
-    except json.JSONDecodeError:
+    except orjson.JSONDecodeError:
         # If it fails, try some basic fixes
         
         # Fix unescaped newlines in strings
-        json_content = re.sub(r'(?<!\\)\n(?=.*"[^"]*$)', '\\n', json_content)
+        json_content = _NL_IN_STR_RE.sub('\\n', json_content)
         
         # Try again
         try:
-            json.loads(json_content)
+            orjson.loads(json_content)
             return json_content
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             # Return as-is and let the caller handle the error
             return json_content
 
 def attempt_json_repair(response_text):
     """Attempt more aggressive JSON repair strategies"""
-    import re
-    
     try:
-        # Start with basic cleaning
-        cleaned = clean_openai_json_response(response_text)
-        
-        # More aggressive repair strategies
-        repair_strategies = [
-            # Strategy 1: Fix newlines and control characters first
-            lambda s: s.replace('\n', '\\n').replace('\r', '\\r').replace('\t', '\\t'),
-            
-            # Strategy 2: Fix unescaped quotes in code strings
-            lambda s: re.sub(r'(:\s*")([^"]*)"([^"]*)"([^"]*)"', r'\1\2\\"\3\\"\4"', s),
-            
-            # Strategy 3: Fix trailing commas
-            lambda s: re.sub(r',(\s*[}\]])', r'\1', s),
-            
-            # Strategy 4: Try to close unterminated strings
-            lambda s: fix_unterminated_strings(s),
-            
-            # Strategy 5: Fix missing commas
-            lambda s: re.sub(r'}(\s*)"', r'},\1"', s),
-        ]
-        
-        current_json = cleaned
+        # Start with basic cleaning; if that already parses, no repair is needed
+        current_json = clean_openai_json_response(response_text)
+        try:
+            orjson.loads(current_json)
+            return current_json
+        except orjson.JSONDecodeError:
+            pass
         
-        for i, strategy in enumerate(repair_strategies):
+        # Apply the strategies cumulatively, stopping at the first result that parses
+        for i, strategy in enumerate(_REPAIR_STRATEGIES):
             try:
-                repaired = strategy(current_json)
-                json.loads(repaired)  # Test if it parses
-                print(f"JSON repair successful with strategy {i+1}")
-                return repaired
-            except (json.JSONDecodeError, Exception) as e:
-                print(f"Strategy {i+1} failed: {e}")
-                current_json = repaired if 'repaired' in locals() else current_json
+                current_json = strategy(current_json)
+                orjson.loads(current_json)  # Test if it parses
+            except Exception as e:
+                logger.debug("Strategy %d failed: %s", i + 1, e)
                 continue
+            logger.debug("JSON repair successful with strategy %d", i + 1)
+            return current_json
         
         # If none work, return None
         return None
         
     except Exception as e:
-        print(f"JSON repair attempt failed: {e}")
+        logger.warning("JSON repair attempt failed: %s", e)
         return None
 
 def fix_unterminated_strings(json_str):
     """Try to fix unterminated strings in JSON"""
-    import re
-    
     # This is a simple heuristic approach
     # Look for patterns like: "key": "value with unterminated string
     lines = json_str.split('\n')
@@ -152,13 +188,8 @@ def fix_unterminated_strings(json_str):
                 key_part = parts[0]
                 value_part = parts[1].strip()
                 
-                # Count unescaped quotes in value part
-                unescaped_quotes = 0
-                i = 0
-                while i < len(value_part):
-                    if value_part[i] == '"' and (i == 0 or value_part[i-1] != '\\'):
-                        unescaped_quotes += 1
-                    i += 1
+                # Count unescaped quotes in value part (two C-level scans instead of a char loop)
+                unescaped_quotes = value_part.count('"') - value_part.count('\\"')
                 
                 # If odd number of quotes and line doesn't end with quote, try to close it
                 if unescaped_quotes % 2 == 1 and not value_part.rstrip().endswith('"'):
@@ -168,37 +199,54 @@ def fix_unterminated_strings(json_str):
     
     return '\n'.join(fixed_lines)
 
+# More aggressive repair strategies, applied in order by attempt_json_repair
+_REPAIR_STRATEGIES = (
+    # Strategy 1: Fix newlines and control characters first
+    lambda s: s.replace('\n', '\\n').replace('\r', '\\r').replace('\t', '\\t'),
+    
+    # Strategy 2: Fix unescaped quotes in code strings
+    lambda s: _UNESCAPED_QUOTES_RE.sub(r'\1\2\\"\3\\"\4"', s),
+    
+    # Strategy 3: Fix trailing commas
+    lambda s: _TRAILING_COMMA_RE.sub(r'\1', s),
+    
+    # Strategy 4: Try to close unterminated strings
+    fix_unterminated_strings,
+    
+    # Strategy 5: Fix missing commas
+    lambda s: _MISSING_COMMA_RE.sub(r'},\1"', s),
+)
+
 def parse_structured_response(response_text):
     """Parse structured text response into replica data"""
-    import re
     try:
         # Extract theme
-        theme_match = re.search(r'THEME:\s*(.+)', response_text)
+        theme_match = _THEME_RE.search(response_text)
         raw_theme = theme_match.group(1).strip() if theme_match else "Untitled Theme"
         
         # Clean up theme - remove any "Replica X" text and ensure it's a clean title
-        theme = re.sub(r'\s*-?\s*Replica\s*\d*\s*', '', raw_theme, flags=re.IGNORECASE).strip()
+        theme = _REPLICA_SUFFIX_RE.sub('', raw_theme).strip()
         if not theme:
             theme = "Custom Theme"
         
         # Extract HTML
-        html_match = re.search(r'HTML_START\s*(.*?)\s*HTML_END', response_text, re.DOTALL)
+        html_match = _HTML_RE.search(response_text)
         html_code = html_match.group(1).strip() if html_match else ""
         
         # Extract CSS  
-        css_match = re.search(r'CSS_START\s*(.*?)\s*CSS_END', response_text, re.DOTALL)
+        css_match = _CSS_RE.search(response_text)
         css_code = css_match.group(1).strip() if css_match else ""
         
         # Extract JavaScript
-        js_match = re.search(r'JS_START\s*(.*?)\s*JS_END', response_text, re.DOTALL)
+        js_match = _JS_RE.search(response_text)
         js_code = js_match.group(1).strip() if js_match else ""
         
         # Extract question
-        question_match = re.search(r'QUESTION_START\s*(.*?)\s*QUESTION_END', response_text, re.DOTALL)
+        question_match = _QUESTION_RE.search(response_text)
         question_text = question_match.group(1).strip() if question_match else ""
         
         # Extract test cases
-        tests_match = re.search(r'TESTS_START\s*(.*?)\s*TESTS_END', response_text, re.DOTALL)
+        tests_match = _TESTS_RE.search(response_text)
         test_cases = tests_match.group(1).strip() if tests_match else ""
         
         # Return structured data
@@ -219,13 +267,20 @@ def parse_structured_response(response_text):
         }
         
     except Exception as e:
-        print(f"Error parsing structured response: {e}")
+        logger.warning("Error parsing structured response: %s", e)
         return None
 
+# Resolved against this file rather than the working directory, so it loads under gunicorn too
+PROMPT_TEMPLATE_PATH = os.getenv(
+    'PROMPT_TEMPLATE_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'webcoding-replicas-prompt.md')
+)
+
+@lru_cache(maxsize=1)
 def load_prompt_template():
-    """Load the webcoding-replication-prompt.md file"""
+    """Load the webcoding-replication-prompt.md file (cached after the first read)"""
     try:
-        with open('../webcoding-replicas-prompt.md', 'r', encoding='utf-8') as f:
+        with open(PROMPT_TEMPLATE_PATH, 'r', encoding='utf-8') as f:
             return f.read()
     except FileNotFoundError:
         return """
@@ -345,223 +400,155 @@ def test_json_parsing():
     
     try:
         cleaned_json = clean_openai_json_response(test_json)
-        parsed = json.loads(cleaned_json)
+        parsed = orjson.loads(cleaned_json)
         return jsonify({"success": True, "parsed": parsed})
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
 @app.route('/api/token-usage', methods=['GET'])
 def get_token_usage():
-    return jsonify(token_usage)
-
-@app.route('/api/generate-replicas', methods=['POST'])
-def generate_replicas():
+    with _token_usage_lock:
+        snapshot = dict(token_usage)
+    return jsonify(snapshot)
+
+# Diverse themes for replicas with context-specific content
+THEMES = (
+    "Coffee Shop Manager", "Pizza Restaurant", "Bakery Counter", "Grocery Store",
+    "Bookstore Inventory", "Game Store", "Electronics Shop", "Fashion Boutique",
+    "Pet Store Manager", "Flower Shop", "Music Store", "Art Gallery",
+    "Sports Equipment", "Candy Store", "Toy Shop", "Pharmacy Counter",
+    "Hardware Store", "Car Rental", "Hotel Booking", "Travel Agency",
+    "Fitness Gym", "Restaurant Menu", "Library System", "Movie Theater",
+    "School Supplies", "Photography Studio", "Beauty Salon", "Laundromat",
+    "Ice Cream Parlor", "Juice Bar", "Bike Rental", "Camping Gear",
+    "Wedding Planner", "Food Truck", "Antique Shop", "Craft Store",
+    "Supermarket Chain", "Farmers Market", "Butcher Shop", "Seafood Market",
+    "Book Café", "Tattoo Studio", "Barbershop", "Nail Salon",
+    "Daycare Center", "E-learning Platform", "Music Academy", "Dance Studio",
+    "Driving School", "Language School", "Martial Arts Dojo", "Cooking Class",
+    "Event Venue", "Conference Center", "Coworking Space", "Startup Incubator",
+    "Real Estate Agency", "Property Rental", "Interior Design Studio", "Furniture Store",
+    "Home Decor Shop", "Lighting Store", "Appliance Store", "Mattress Shop",
+    "Garden Center", "Plant Nursery", "Organic Store", "Wine Shop",
+    "Brewery Taproom", "Sports Bar", "Nightclub Manager", "Concert Hall",
+    "Theater Playhouse", "Amusement Park", "Zoo Management", "Aquarium Center",
+    "Theme Park", "Arcade Center", "Escape Room", "Bowling Alley",
+    "Skating Rink", "Golf Course", "Tennis Club", "Soccer Academy",
+    "Hospital Management", "Clinic Reception", "Dental Office", "Veterinary Clinic",
+    "Pharmaceutical Store", "Optical Shop", "Hearing Aid Center", "Rehab Center",
+    "Courier Service", "Logistics Hub", "Airline Booking", "Shipping Company",
+    "Taxi Service", "Ride Sharing", "Parking Garage", "Fuel Station",
+    "Tech Repair Shop", "Mobile Store", "Laptop Store", "Watch Boutique",
+    "Jewelry Store", "Perfume Shop", "Handbag Boutique", "Shoe Store",
+    "Surf Shop", "Diving Center", "Ski Resort", "Snowboard Shop",
+    "Mountain Guide", "Hiking Supplies", "Fishing Store", "Hunting Shop",
+    "Board Game Café", "VR Arcade", "Esports Arena", "Streaming Studio",
+    "Podcast Studio", "Radio Station", "TV Channel Manager", "Film Production",
+    "Animation Studio", "Advertising Agency", "Consulting Firm", "HR Platform",
+    "Payroll Service", "Law Firm", "Notary Office", "Insurance Agency",
+    "Bank Branch", "Stock Brokerage", "Investment Firm", "Cryptocurrency Exchange",
+    "Charity Organization", "NGO Manager", "Volunteer Center", "Community Center",
+    "Religious Organization", "Church Management", "Mosque Administration", "Temple Management",
+    "Resort Manager", "Holiday Park", "Hostel Manager", "Bed and Breakfast",
+    "Vacation Rentals", "Timeshare Service", "RV Rental", "Yacht Rental",
+    "Cruise Line", "Train Service", "Metro Station", "Bus Depot",
+    "Trucking Company", "Warehousing Hub", "Cold Storage", "Freight Forwarding",
+    "Drone Delivery", "Postal Service", "Bike Courier", "Farmland Manager",
+    "Dairy Farm", "Poultry Farm", "Fishery Farm", "Aquaponics Farm",
+    "Greenhouse Farming", "Hydroponics Farm", "Crop Trading", "Fertilizer Shop",
+    "Seed Store", "Tractor Rental", "Mining Operations", "Oil Refinery",
+    "Solar Energy Plant", "Wind Farm", "Hydropower Plant", "Recycling Plant",
+    "Construction Firm", "Architecture Studio", "Cement Factory", "Steel Plant",
+    "Clothing Store", "Streetwear Shop", "Sports Apparel", "Tailor Shop",
+    "Textile Factory", "Leather Goods", "Accessories Store", "Cap Store",
+    "Restaurant Chain", "Buffet Restaurant", "Fine Dining", "Fast Food Outlet",
+    "Burger Joint", "Sandwich Shop", "Steakhouse", "Seafood Restaurant",
+    "Vegan Café", "Salad Bar", "Soup Kitchen", "Catering Service",
+    "Ramen Shop", "Sushi Bar", "Dim Sum Place", "Mexican Cantina",
+    "French Bistro", "Greek Taverna", "Turkish Kebab Shop", "Caribbean Restaurant",
+    "Cupcake Store", "Donut Shop", "Chocolate Boutique", "Crepe Stand",
+    "Pancake House", "Waffle Bar", "Coffee Roastery", "Bubble Tea Shop",
+    "Gaming Café", "Internet Café", "Makerspace", "Electronics Repair",
+    "Drone Store", "Smart Home Store", "AR Experience Center", "Tech Museum",
+    "Airport Duty Free", "Railway Station Shop", "Pop-Up Shop", "Music Festival Manager",
+    "Conference Organizer", "Sports League Manager", "Basketball Team", "Baseball Team",
+    "Football Club", "Olympics Committee", "Circus Show", "Comedy Club",
+    "Medical Research Lab", "Biotech Startup", "Pharma Manufacturing", "Health Insurance",
+    "Yoga Studio", "Meditation Center", "Spa Resort", "Ayurveda Clinic",
+    "News Agency", "Book Publisher", "Printing Press", "Stationery Shop",
+    "Souvenir Shop", "Gift Wrapping Service", "Party Supplies", "Costume Rental",
+    "Photo Booth", "DJ Service", "Karaoke Bar", "Open Mic Café",
+    "Software Company", "Web Design Agency", "Game Development Studio", "Cloud Hosting",
+    "Robotics Startup", "IoT Platform", "Blockchain Startup", "Metaverse Hub",
+    "Wildlife Sanctuary", "National Park", "Botanical Garden", "Heritage Site",
+    "Science Center", "Planetarium", "Space Observatory", "Rocket Launch Center",
+    "City Hall", "Post Office", "Police Department", "Fire Department",
+    "Ambulance Service", "Disaster Relief", "Customs Office", "Immigration Service",
+    "Military Base", "Airport Security", "Playground", "Water Park",
+    "Laser Tag Arena", "Go-Kart Track", "Horse Riding School", "Animal Shelter",
+    "Dog Grooming", "Cat Café",
+    "Elder Care Home", "Retirement Community", "Boarding School", "University Campus",
+    "Student Housing", "Scholarship Fund", "Exam Prep Center", "Research Institute",
+    "IT Training Center", "Coding Bootcamp", "Virtual Classroom", "MOOC Platform",
+    "Job Portal", "Freelance Marketplace", "Gig Economy Platform", "Remote Work Hub",
+    "Interior Landscaping", "Pool Maintenance", "Roofing Company", "Home Renovation",
+    "Carpentry Workshop", "Plumbing Services", "Electrical Services", "Solar Installer",
+    "Moving Company", "Cleaning Services", "Pest Control", "Security Services",
+    "CCTV Store", "Alarm Installation", "Locksmith Services", "Smart Security Hub",
+    "Baby Store", "Maternity Shop", "Toy Rental", "Kids Party Planner",
+    "Children’s Bookstore", "Comic Convention", "Cosplay Shop", "Boarding Kennel",
+    "Pet Daycare", "Pet Hotel", "Exotic Pet Store", "Aquarium Fish Shop",
+    "Bird Store", "Reptile Shop", "Pet Grooming School", "Dog Training Center",
+    "Organic Bakery", "Gluten-Free Store", "Keto Café", "Protein Bar",
+    "Smoothie Shop", "Vegan Market", "Ethnic Grocery", "Spice Shop",
+    "Olive Oil Shop", "Cheese Store", "Butcher Deli", "Farm-to-Table Restaurant",
+    "Artisan Coffee Roaster", "Craft Brewery", "Whiskey Distillery", "Gin Bar",
+    "Cigar Lounge", "Shisha Café", "Hookah Bar", "Wine Tasting Room",
+    "Luxury Spa", "Thermal Baths", "Hot Spring Resort", "Detox Center",
+    "Pilates Studio", "CrossFit Gym", "Boxing Club", "Climbing Gym",
+    "Skateboard Shop", "Roller Rink", "Parkour Gym", "Adventure Park",
+    "Drone Racing Arena", "RC Car Track", "Model Train Store", "LEGO Store",
+    "3D Printing Service", "Makers Lab", "Prototype Studio", "Electronics Lab",
+    "AR Gaming Arena", "Mixed Reality Studio", "Digital Art Gallery", "NFT Marketplace",
+    "Crypto Mining Farm", "Token Exchange", "DeFi Platform", "Metaverse Land Agency",
+    "Virtual Fashion Boutique", "VR Fitness Studio", "Online Casino", "Sports Betting",
+    "Horse Racing Track", "Dog Racing Arena", "Lottery Kiosk", "Bingo Hall",
+    "Community Radio", "Indie Film Studio", "Streaming Platform", "Music Label",
+    "Talent Scout", "Modeling Agency", "Casting Studio", "Script Writing Agency",
+    "Translation Service", "Subtitling Service", "Voiceover Studio", "Dubbing Studio",
+    "Content Creation Hub", "Influencer Agency", "Social Media Agency", "SEO Firm",
+    "Data Analytics Firm", "AI Consultancy", "ML Research Lab", "Cloud AI Service",
+    "Drone Photography", "Aerial Mapping", "Survey Company", "GIS Mapping",
+    "Real Estate Drone Tours", "Property Management", "Condominium Manager", "HOA Manager",
+    "Urban Planning Firm", "Smart City Platform", "Transport Authority", "Highway Management",
+    "Port Authority", "Shipyard", "Harbor Management", "Fisherman’s Wharf",
+    "Luxury Car Dealer", "Used Car Dealer", "Motorcycle Shop", "Scooter Rental",
+    "EV Charging Station", "EV Rental", "Battery Swap Station", "Green Energy Store",
+    "Charcoal Shop", "BBQ Supplies", "Kitchen Equipment Store", "Cooking Oil Shop",
+    "Packaging Supplies", "Paper Mill", "Printing Ink Store", "Label Printing",
+    "Advertising Print Shop", "Merchandise Store", "Souvenir Kiosk", "Festival Booth",
+    "Holiday Decor Store", "Halloween Shop", "Christmas Market", "Fireworks Stand",
+    "Gift Basket Store", "Luxury Gifting Service", "Diamond Store", "Gemstone Boutique",
+    "Goldsmith", "Silversmith", "Engraving Shop", "Watch Customization",
+    "Vintage Car Rental", "Classic Car Restoration", "Motor Garage", "Auto Parts Shop",
+    "Tire Shop", "Car Wash", "Detailing Center", "Tow Truck Service",
+    "Scrapyard", "Metal Recycling", "E-waste Recycling", "Battery Recycling",
+    "Eco-Friendly Products", "Zero Waste Store", "Thrift Shop", "Second-Hand Store",
+    "Pawn Broker", "Consignment Store", "Auction House", "Art Auction",
+    "Collector’s Shop", "Stamp Shop", "Coin Shop", "Antique Bookstore",
+    "Rare Vinyl Store", "Vintage Clothing Shop", "Retro Arcade", "Classic Game Shop",
+)
+
+# Upper bound on concurrent OpenAI calls per request
+MAX_REPLICA_WORKERS = 10
+
+def generate_single_replica(i, selected_theme, single_replica_prompt):
+    """Generate and parse one replica; returns (replica_data, output_tokens)"""
+    theme_suffix = selected_theme.lower().replace(' ', '-').replace('store', '').replace('shop', '').replace('manager', '').strip('-')
+    
     try:
-        data = request.json
-        
-        # Validate required fields
-        required_fields = ['question_text', 'short_text', 'solutions_metadata', 'test_cases', 'replica_type', 'num_replicas']
-        for field in required_fields:
-            if field not in data:
-                return jsonify({"error": f"Missing required field: {field}"}), 400
-        
-        # Extract code from solutions_metadata
-        solutions = data['solutions_metadata'][0] if data['solutions_metadata'] else {}
-        code_details = solutions.get('code_details', [])
-        
-        html_code = ""
-        css_code = ""
-        js_code = ""
-        
-        for code_detail in code_details:
-            if code_detail.get('language') == 'HTML':
-                html_code = code_detail.get('code_data', '')
-            elif code_detail.get('language') == 'CSS':
-                css_code = code_detail.get('code_data', '')
-            elif code_detail.get('language') == 'JAVASCRIPT':
-                js_code = code_detail.get('code_data', '')
-        
-        # Format test cases
-        test_cases_text = ""
-        for test_case in data.get('test_cases', []):
-            test_cases_text += f"Test Case {test_case.get('order', '')}: {test_case.get('display_text', '')}\n"
-            test_cases_text += f"Criteria: {test_case.get('criteria', '')}\n\n"
-        
-        # Load and format prompt template
-        prompt_template = load_prompt_template()
-        
-        # Replace placeholders in prompt
-        formatted_prompt = prompt_template.replace('{{original_html}}', html_code)
-        formatted_prompt = formatted_prompt.replace('{{original_css}}', css_code)
-        formatted_prompt = formatted_prompt.replace('{{original_js}}', js_code)
-        formatted_prompt = formatted_prompt.replace('{{short_description}}', data['short_text'])
-        formatted_prompt = formatted_prompt.replace('{{problem_statement}}', data['question_text'])
-        formatted_prompt = formatted_prompt.replace('{{test_scenarios}}', test_cases_text)
-        formatted_prompt = formatted_prompt.replace('{{N}}', str(data['num_replicas']))
-        
-        # Count input tokens
-        input_tokens = count_tokens(formatted_prompt)
-        
-        # Call OpenAI API
-        current_api_key = os.getenv('OPENAI_API_KEY', '')
-        if not current_api_key:
-            print("ERROR: OpenAI API key not found in environment!")
-            return jsonify({"error": "OpenAI API key not configured"}), 500
-
-        print(f"Making OpenAI API call with key: {current_api_key[:10]}...")
-
-        # Define diverse themes for each replica with context-specific content
-        themes =[
-  "Coffee Shop Manager", "Pizza Restaurant", "Bakery Counter", "Grocery Store",
-  "Bookstore Inventory", "Game Store", "Electronics Shop", "Fashion Boutique",
-  "Pet Store Manager", "Flower Shop", "Music Store", "Art Gallery",
-  "Sports Equipment", "Candy Store", "Toy Shop", "Pharmacy Counter",
-  "Hardware Store", "Car Rental", "Hotel Booking", "Travel Agency",
-  "Fitness Gym", "Restaurant Menu", "Library System", "Movie Theater",
-  "School Supplies", "Photography Studio", "Beauty Salon", "Laundromat",
-  "Ice Cream Parlor", "Juice Bar", "Bike Rental", "Camping Gear",
-  "Wedding Planner", "Food Truck", "Antique Shop", "Craft Store",
-  "Supermarket Chain", "Farmers Market", "Butcher Shop", "Seafood Market",
-  "Book Café", "Tattoo Studio", "Barbershop", "Nail Salon",
-  "Daycare Center", "E-learning Platform", "Music Academy", "Dance Studio",
-  "Driving School", "Language School", "Martial Arts Dojo", "Cooking Class",
-  "Event Venue", "Conference Center", "Coworking Space", "Startup Incubator",
-  "Real Estate Agency", "Property Rental", "Interior Design Studio", "Furniture Store",
-  "Home Decor Shop", "Lighting Store", "Appliance Store", "Mattress Shop",
-  "Garden Center", "Plant Nursery", "Organic Store", "Wine Shop",
-  "Brewery Taproom", "Sports Bar", "Nightclub Manager", "Concert Hall",
-  "Theater Playhouse", "Amusement Park", "Zoo Management", "Aquarium Center",
-  "Theme Park", "Arcade Center", "Escape Room", "Bowling Alley",
-  "Skating Rink", "Golf Course", "Tennis Club", "Soccer Academy",
-  "Hospital Management", "Clinic Reception", "Dental Office", "Veterinary Clinic",
-  "Pharmaceutical Store", "Optical Shop", "Hearing Aid Center", "Rehab Center",
-  "Courier Service", "Logistics Hub", "Airline Booking", "Shipping Company",
-  "Taxi Service", "Ride Sharing", "Parking Garage", "Fuel Station",
-  "Tech Repair Shop", "Mobile Store", "Laptop Store", "Watch Boutique",
-  "Jewelry Store", "Perfume Shop", "Handbag Boutique", "Shoe Store",
-  "Surf Shop", "Diving Center", "Ski Resort", "Snowboard Shop",
-  "Mountain Guide", "Hiking Supplies", "Fishing Store", "Hunting Shop",
-  "Board Game Café", "VR Arcade", "Esports Arena", "Streaming Studio",
-  "Podcast Studio", "Radio Station", "TV Channel Manager", "Film Production",
-  "Animation Studio", "Advertising Agency", "Consulting Firm", "HR Platform",
-  "Payroll Service", "Law Firm", "Notary Office", "Insurance Agency",
-  "Bank Branch", "Stock Brokerage", "Investment Firm", "Cryptocurrency Exchange",
-  "Charity Organization", "NGO Manager", "Volunteer Center", "Community Center",
-  "Religious Organization", "Church Management", "Mosque Administration", "Temple Management",
-  "Resort Manager", "Holiday Park", "Hostel Manager", "Bed and Breakfast",
-  "Vacation Rentals", "Timeshare Service", "RV Rental", "Yacht Rental",
-  "Cruise Line", "Train Service", "Metro Station", "Bus Depot",
-  "Trucking Company", "Warehousing Hub", "Cold Storage", "Freight Forwarding",
-  "Drone Delivery", "Postal Service", "Bike Courier", "Farmland Manager",
-  "Dairy Farm", "Poultry Farm", "Fishery Farm", "Aquaponics Farm",
-  "Greenhouse Farming", "Hydroponics Farm", "Crop Trading", "Fertilizer Shop",
-  "Seed Store", "Tractor Rental", "Mining Operations", "Oil Refinery",
-  "Solar Energy Plant", "Wind Farm", "Hydropower Plant", "Recycling Plant",
-  "Construction Firm", "Architecture Studio", "Cement Factory", "Steel Plant",
-  "Clothing Store", "Streetwear Shop", "Sports Apparel", "Tailor Shop",
-  "Textile Factory", "Leather Goods", "Accessories Store", "Cap Store",
-  "Restaurant Chain", "Buffet Restaurant", "Fine Dining", "Fast Food Outlet",
-  "Burger Joint", "Sandwich Shop", "Steakhouse", "Seafood Restaurant",
-  "Vegan Café", "Salad Bar", "Soup Kitchen", "Catering Service",
-  "Ramen Shop", "Sushi Bar", "Dim Sum Place", "Mexican Cantina",
-  "French Bistro", "Greek Taverna", "Turkish Kebab Shop", "Caribbean Restaurant",
-  "Cupcake Store", "Donut Shop", "Chocolate Boutique", "Crepe Stand",
-  "Pancake House", "Waffle Bar", "Coffee Roastery", "Bubble Tea Shop",
-  "Gaming Café", "Internet Café", "Makerspace", "Electronics Repair",
-  "Drone Store", "Smart Home Store", "AR Experience Center", "Tech Museum",
-  "Airport Duty Free", "Railway Station Shop", "Pop-Up Shop", "Music Festival Manager",
-  "Conference Organizer", "Sports League Manager", "Basketball Team", "Baseball Team",
-  "Football Club", "Olympics Committee", "Circus Show", "Comedy Club",
-  "Medical Research Lab", "Biotech Startup", "Pharma Manufacturing", "Health Insurance",
-  "Yoga Studio", "Meditation Center", "Spa Resort", "Ayurveda Clinic",
-  "News Agency", "Book Publisher", "Printing Press", "Stationery Shop",
-  "Souvenir Shop", "Gift Wrapping Service", "Party Supplies", "Costume Rental",
-  "Photo Booth", "DJ Service", "Karaoke Bar", "Open Mic Café",
-  "Software Company", "Web Design Agency", "Game Development Studio", "Cloud Hosting",
-  "Robotics Startup", "IoT Platform", "Blockchain Startup", "Metaverse Hub",
-  "Wildlife Sanctuary", "National Park", "Botanical Garden", "Heritage Site",
-  "Science Center", "Planetarium", "Space Observatory", "Rocket Launch Center",
-  "City Hall", "Post Office", "Police Department", "Fire Department",
-  "Ambulance Service", "Disaster Relief", "Customs Office", "Immigration Service",
-  "Military Base", "Airport Security", "Playground", "Water Park",
-  "Laser Tag Arena", "Go-Kart Track", "Horse Riding School", "Animal Shelter",
-  "Dog Grooming", "Cat Café",
-  "Elder Care Home", "Retirement Community", "Boarding School", "University Campus",
-  "Student Housing", "Scholarship Fund", "Exam Prep Center", "Research Institute",
-  "IT Training Center", "Coding Bootcamp", "Virtual Classroom", "MOOC Platform",
-  "Job Portal", "Freelance Marketplace", "Gig Economy Platform", "Remote Work Hub",
-  "Interior Landscaping", "Pool Maintenance", "Roofing Company", "Home Renovation",
-  "Carpentry Workshop", "Plumbing Services", "Electrical Services", "Solar Installer",
-  "Moving Company", "Cleaning Services", "Pest Control", "Security Services",
-  "CCTV Store", "Alarm Installation", "Locksmith Services", "Smart Security Hub",
-  "Baby Store", "Maternity Shop", "Toy Rental", "Kids Party Planner",
-  "Children’s Bookstore", "Comic Convention", "Cosplay Shop", "Boarding Kennel",
-  "Pet Daycare", "Pet Hotel", "Exotic Pet Store", "Aquarium Fish Shop",
-  "Bird Store", "Reptile Shop", "Pet Grooming School", "Dog Training Center",
-  "Organic Bakery", "Gluten-Free Store", "Keto Café", "Protein Bar",
-  "Smoothie Shop", "Vegan Market", "Ethnic Grocery", "Spice Shop",
-  "Olive Oil Shop", "Cheese Store", "Butcher Deli", "Farm-to-Table Restaurant",
-  "Artisan Coffee Roaster", "Craft Brewery", "Whiskey Distillery", "Gin Bar",
-  "Cigar Lounge", "Shisha Café", "Hookah Bar", "Wine Tasting Room",
-  "Luxury Spa", "Thermal Baths", "Hot Spring Resort", "Detox Center",
-  "Pilates Studio", "CrossFit Gym", "Boxing Club", "Climbing Gym",
-  "Skateboard Shop", "Roller Rink", "Parkour Gym", "Adventure Park",
-  "Drone Racing Arena", "RC Car Track", "Model Train Store", "LEGO Store",
-  "3D Printing Service", "Makers Lab", "Prototype Studio", "Electronics Lab",
-  "AR Gaming Arena", "Mixed Reality Studio", "Digital Art Gallery", "NFT Marketplace",
-  "Crypto Mining Farm", "Token Exchange", "DeFi Platform", "Metaverse Land Agency",
-  "Virtual Fashion Boutique", "VR Fitness Studio", "Online Casino", "Sports Betting",
-  "Horse Racing Track", "Dog Racing Arena", "Lottery Kiosk", "Bingo Hall",
-  "Community Radio", "Indie Film Studio", "Streaming Platform", "Music Label",
-  "Talent Scout", "Modeling Agency", "Casting Studio", "Script Writing Agency",
-  "Translation Service", "Subtitling Service", "Voiceover Studio", "Dubbing Studio",
-  "Content Creation Hub", "Influencer Agency", "Social Media Agency", "SEO Firm",
-  "Data Analytics Firm", "AI Consultancy", "ML Research Lab", "Cloud AI Service",
-  "Drone Photography", "Aerial Mapping", "Survey Company", "GIS Mapping",
-  "Real Estate Drone Tours", "Property Management", "Condominium Manager", "HOA Manager",
-  "Urban Planning Firm", "Smart City Platform", "Transport Authority", "Highway Management",
-  "Port Authority", "Shipyard", "Harbor Management", "Fisherman’s Wharf",
-  "Luxury Car Dealer", "Used Car Dealer", "Motorcycle Shop", "Scooter Rental",
-  "EV Charging Station", "EV Rental", "Battery Swap Station", "Green Energy Store",
-  "Charcoal Shop", "BBQ Supplies", "Kitchen Equipment Store", "Cooking Oil Shop",
-  "Packaging Supplies", "Paper Mill", "Printing Ink Store", "Label Printing",
-  "Advertising Print Shop", "Merchandise Store", "Souvenir Kiosk", "Festival Booth",
-  "Holiday Decor Store", "Halloween Shop", "Christmas Market", "Fireworks Stand",
-  "Gift Basket Store", "Luxury Gifting Service", "Diamond Store", "Gemstone Boutique",
-  "Goldsmith", "Silversmith", "Engraving Shop", "Watch Customization",
-  "Vintage Car Rental", "Classic Car Restoration", "Motor Garage", "Auto Parts Shop",
-  "Tire Shop", "Car Wash", "Detailing Center", "Tow Truck Service",
-  "Scrapyard", "Metal Recycling", "E-waste Recycling", "Battery Recycling",
-  "Eco-Friendly Products", "Zero Waste Store", "Thrift Shop", "Second-Hand Store",
-  "Pawn Broker", "Consignment Store", "Auction House", "Art Auction",
-  "Collector’s Shop", "Stamp Shop", "Coin Shop", "Antique Bookstore",
-  "Rare Vinyl Store", "Vintage Clothing Shop", "Retro Arcade", "Classic Game Shop"
-]
-
-        
-        # Shuffle themes to avoid predictable patterns across multiple generations
-        import random
-        shuffled_themes = themes.copy()
-        random.shuffle(shuffled_themes)
-        
-        # For now, let's generate replicas one at a time to avoid JSON parsing issues
-        num_replicas = int(data['num_replicas'])
-        all_replicas = {}
-        total_output_tokens = 0
-        
-        for i in range(1, num_replicas + 1):
-            # Get a unique theme for this replica
-            theme_index = (i - 1) % len(themes)
-            selected_theme = themes[theme_index]
-            theme_suffix = selected_theme.lower().replace(' ', '-').replace('store', '').replace('shop', '').replace('manager', '').strip('-')
-            
-            # Create a prompt for just one replica with specific theme
-            single_replica_prompt = formatted_prompt.replace(f'**{num_replicas}**', '**1**')
-            single_replica_prompt = single_replica_prompt.replace('Generate **{N}** replicas', 'Generate **1** replica')
-            
-            try:
-                # Use a structured text format instead of JSON to avoid parsing issues
-                structured_prompt = f"""
+        # Use a structured text format instead of JSON to avoid parsing issues
+        structured_prompt = f"""
 Create a web coding replica with the following format:
 
 THEME: {selected_theme}
@@ -599,11 +586,11 @@ Original content to transform:
 
 Generate exactly ONE replica with "{selected_theme}" theme and consistent ID naming using "{theme_suffix}" suffix.
 """
-                
-                response = openai.ChatCompletion.create(
-                    model="gpt-3.5-turbo",
-                    messages=[
-                        {"role": "system", "content": f"""You are a web developer who creates themed code replicas with completely unique contexts.
+        
+        response = openai.ChatCompletion.create(
+            model="gpt-3.5-turbo",
+            messages=[
+                {"role": "system", "content": f"""You are a web developer who creates themed code replicas with completely unique contexts.
 
 MANDATORY REQUIREMENTS FOR "{selected_theme}" THEME:
 1. Transform ALL text content to match "{selected_theme}" context exactly
@@ -625,68 +612,145 @@ ID CONSISTENCY RULES:
 - NO generic IDs, ALL must use "{theme_suffix}" suffix
 
 Use the THEME/HTML_START/HTML_END format exactly. Do not use JSON. Make this replica completely unique with "{selected_theme}" context."""},
-                        {"role": "user", "content": structured_prompt}
-                    ],
-                    max_tokens=2500,
-                    temperature=0.7
-                )
-                
-                # Parse this single replica
-                response_content = response.choices[0].message.content
-                total_output_tokens += count_tokens(response_content)
-                
-                print(f"Replica {i} response length: {len(response_content)}")
-                
-                try:
-                    # Parse the structured text response
-                    replica_data = parse_structured_response(response_content)
-                    
-                    if replica_data:
-                        all_replicas[f'replica_{i}'] = replica_data
-                        print(f"Successfully generated replica {i}")
-                    else:
-                        all_replicas[f'replica_{i}'] = {
-                            "error": f"Failed to parse structured response for replica {i}",
-                            "raw_response": response_content[:500]
-                        }
-                    
-                except Exception as e:
-                    print(f"Parsing error for replica {i}: {str(e)}")
-                    all_replicas[f'replica_{i}'] = {
-                        "error": f"Failed to parse replica {i}: {str(e)}",
-                        "raw_response": response_content[:500]
-                    }
-                
-            except Exception as api_error:
-                print(f"OpenAI API Error for replica {i}: {str(api_error)}")
-                all_replicas[f'replica_{i}'] = {
-                    "error": f"API Error: {str(api_error)}"
-                }
+                {"role": "user", "content": structured_prompt}
+            ],
+            max_tokens=2500,
+            temperature=0.7
+        )
+        
+        # Parse this single replica
+        response_content = response.choices[0].message.content
+        output_tokens = count_tokens(response_content)
+        
+        logger.debug("Replica %d response length: %d", i, len(response_content))
+        
+        try:
+            # Parse the structured text response
+            replica_data = parse_structured_response(response_content)
+            
+            if replica_data:
+                logger.debug("Successfully generated replica %d", i)
+                return replica_data, output_tokens
+            return {
+                "error": f"Failed to parse structured response for replica {i}",
+                "raw_response": response_content[:500]
+            }, output_tokens
+            
+        except Exception as e:
+            logger.warning("Parsing error for replica %d: %s", i, e)
+            return {
+                "error": f"Failed to parse replica {i}: {str(e)}",
+                "raw_response": response_content[:500]
+            }, output_tokens
+        
+    except Exception as api_error:
+        logger.error("OpenAI API Error for replica %d: %s", i, api_error)
+        return {
+            "error": f"API Error: {str(api_error)}"
+        }, 0
+
+@app.route('/api/generate-replicas', methods=['POST'])
+def generate_replicas():
+    try:
+        data = request.json
+        
+        # Validate required fields
+        required_fields = ['question_text', 'short_text', 'solutions_metadata', 'test_cases', 'replica_type', 'num_replicas']
+        for field in required_fields:
+            if field not in data:
+                return jsonify({"error": f"Missing required field: {field}"}), 400
+        
+        # Extract code from solutions_metadata
+        solutions = data['solutions_metadata'][0] if data['solutions_metadata'] else {}
+        code_details = solutions.get('code_details', [])
+        
+        html_code = ""
+        css_code = ""
+        js_code = ""
+        
+        for code_detail in code_details:
+            if code_detail.get('language') == 'HTML':
+                html_code = code_detail.get('code_data', '')
+            elif code_detail.get('language') == 'CSS':
+                css_code = code_detail.get('code_data', '')
+            elif code_detail.get('language') == 'JAVASCRIPT':
+                js_code = code_detail.get('code_data', '')
+        
+        # Format test cases
+        test_cases_text = "".join(
+            f"Test Case {test_case.get('order', '')}: {test_case.get('display_text', '')}\n"
+            f"Criteria: {test_case.get('criteria', '')}\n\n"
+            for test_case in data.get('test_cases', [])
+        )
+        
+        # Load and format prompt template
+        prompt_template = load_prompt_template()
+        
+        # Replace placeholders in prompt
+        formatted_prompt = prompt_template.replace('{{original_html}}', html_code)
+        formatted_prompt = formatted_prompt.replace('{{original_css}}', css_code)
+        formatted_prompt = formatted_prompt.replace('{{original_js}}', js_code)
+        formatted_prompt = formatted_prompt.replace('{{short_description}}', data['short_text'])
+        formatted_prompt = formatted_prompt.replace('{{problem_statement}}', data['question_text'])
+        formatted_prompt = formatted_prompt.replace('{{test_scenarios}}', test_cases_text)
+        formatted_prompt = formatted_prompt.replace('{{N}}', str(data['num_replicas']))
+        
+        # Count input tokens
+        input_tokens = count_tokens(formatted_prompt)
+        
+        # Call OpenAI API
+        current_api_key = os.getenv('OPENAI_API_KEY', '')
+        if not current_api_key:
+            logger.error("OpenAI API key not found in environment!")
+            return jsonify({"error": "OpenAI API key not configured"}), 500
+
+        logger.debug("Making OpenAI API call with key: %s...", current_api_key[:10])
+        
+        # For now, let's generate replicas one at a time to avoid JSON parsing issues
+        num_replicas = int(data['num_replicas'])
+        all_replicas = {}
+        total_output_tokens = 0
+        
+        # Create a prompt for just one replica; it is the same for every theme
+        single_replica_prompt = formatted_prompt.replace(f'**{num_replicas}**', '**1**').replace(
+            'Generate **{N}** replicas', 'Generate **1** replica'
+        )
+        
+        # Draw distinct themes per request (they only repeat past the table size)
+        sampled_themes = random.sample(THEMES, min(num_replicas, len(THEMES)))
+        replica_themes = [sampled_themes[(i - 1) % len(sampled_themes)] for i in range(1, num_replicas + 1)]
+        
+        # Generate the replicas on a thread pool so their OpenAI calls overlap;
+        # map yields results in replica order
+        with ThreadPoolExecutor(max_workers=max(1, min(num_replicas, MAX_REPLICA_WORKERS))) as executor:
+            replica_results = executor.map(
+                generate_single_replica,
+                range(1, num_replicas + 1),
+                replica_themes,
+                repeat(single_replica_prompt)
+            )
+            for i, (replica_data, output_tokens) in enumerate(replica_results, start=1):
+                all_replicas[f'replica_{i}'] = replica_data
+                total_output_tokens += output_tokens
 
         # Calculate total tokens
         total_request_tokens = input_tokens + total_output_tokens
 
-        # Update token tracking
-        token_usage['session_tokens'] += total_request_tokens
-        token_usage['total_tokens'] += total_request_tokens
+        # Update token tracking once per request and keep a consistent snapshot for the response
+        with _token_usage_lock:
+            token_usage['session_tokens'] += total_request_tokens
+            token_usage['total_tokens'] += total_request_tokens
+            session_usage = dict(token_usage)
 
         # Set generated_replicas to our collected replicas
         generated_replicas = all_replicas
         
-        # Add metadata to each replica
-        subtopic = data.get('subtopic', '')
-        course = data.get('course', '')
-        module = data.get('module', '')
-        unit = data.get('unit', '')
-        
-        for replica_key in generated_replicas:
-            if isinstance(generated_replicas[replica_key], dict):
-                generated_replicas[replica_key].update({
-                    'subtopic': subtopic,
-                    'course': course,
-                    'module': module,
-                    'unit': unit
-                })
+        # Add metadata to each replica (built once; it is the same for all of them)
+        metadata = {field: data.get(field, '') for field in ('subtopic', 'course', 'module', 'unit')}
+        
+        for replica in generated_replicas.values():
+            if isinstance(replica, dict):
+                replica.update(metadata)
         
         return jsonify({
             "success": True,
@@ -696,55 +760,59 @@ Use the THEME/HTML_START/HTML_END format exactly. Do not use JSON. Make this rep
                 "output_tokens": total_output_tokens,
                 "total_tokens": total_request_tokens
             },
-            "session_usage": token_usage
+            "session_usage": session_usage
         })
         
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+# Excel export layout: column header and the replica field that fills it
+EXCEL_COLUMNS = (
+    ('Short_Text', 'short_text'),
+    ('HTML_Code', 'html_code'),
+    ('CSS_Code', 'css_code'),
+    ('Js_Code', 'js_code'),
+    ('Question_text', 'question_text'),
+    ('Test_cases', 'test_cases'),
+    ('HTML_Solution', 'html_solution'),
+    ('CSS_Solution', 'css_solution'),
+    ('JS_Solution', 'js_solution'),
+    ('Subtopic', 'subtopic'),
+    ('Course', 'course'),
+    ('Module', 'module'),
+    ('Unit', 'unit'),
+)
+EXCEL_HEADERS = tuple(header for header, _ in EXCEL_COLUMNS)
+EXCEL_KEYS = tuple(key for _, key in EXCEL_COLUMNS)
+
 @app.route('/api/download-excel', methods=['POST'])
 def download_excel():
     try:
         data = request.json
         replicas = data.get('replicas', {})
         
-        # Prepare data for Excel
-        excel_data = []
+        # Stream rows straight into a write-only workbook instead of building a DataFrame
+        workbook = Workbook(write_only=True)
+        worksheet = workbook.create_sheet('Replicas')
+        worksheet.append(EXCEL_HEADERS)
         
         for replica_key, replica_data in replicas.items():
             if isinstance(replica_data, dict):
                 # Format test cases as string
-                test_cases_str = ""
-                if isinstance(replica_data.get('test_cases'), list):
-                    for tc in replica_data.get('test_cases', []):
-                        test_cases_str += f"{tc}\n"
+                test_cases = replica_data.get('test_cases', '')
+                if isinstance(test_cases, list):
+                    test_cases_str = "".join(f"{tc}\n" for tc in test_cases)
                 else:
-                    test_cases_str = str(replica_data.get('test_cases', ''))
+                    test_cases_str = str(test_cases)
                 
-                excel_data.append({
-                    'Short_Text': replica_data.get('short_text', ''),
-                    'HTML_Code': replica_data.get('html_code', ''),
-                    'CSS_Code': replica_data.get('css_code', ''),
-                    'Js_Code': replica_data.get('js_code', ''),
-                    'Question_text': replica_data.get('question_text', ''),
-                    'Test_cases': test_cases_str,
-                    'HTML_Solution': replica_data.get('html_solution', ''),
-                    'CSS_Solution': replica_data.get('css_solution', ''),
-                    'JS_Solution': replica_data.get('js_solution', ''),
-                    'Subtopic': replica_data.get('subtopic', ''),
-                    'Course': replica_data.get('course', ''),
-                    'Module': replica_data.get('module', ''),
-                    'Unit': replica_data.get('unit', '')
-                })
-        
-        # Create DataFrame and Excel file
-        df = pd.DataFrame(excel_data)
+                worksheet.append(tuple(
+                    test_cases_str if key == 'test_cases' else replica_data.get(key, '')
+                    for key in EXCEL_KEYS
+                ))
         
         # Create Excel file in memory
         output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, sheet_name='Replicas', index=False)
-        
+        workbook.save(output)
         output.seek(0)
         
         return send_file(
@@ -762,13 +830,8 @@ def download_json():
     try:
         data = request.json
         
-        # Create JSON file in memory
-        output = io.StringIO()
-        json.dump(data, output, indent=2)
-        output.seek(0)
-        
-        # Convert to bytes
-        json_bytes = io.BytesIO(output.getvalue().encode('utf-8'))
+        # Create JSON file in memory (orjson emits UTF-8 bytes directly)
+        json_bytes = io.BytesIO(orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
         
         return send_file(
             json_bytes,
@@ -781,4 +844,4 @@ def download_json():
         return jsonify({"error": str(e)}), 500
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    app.run(debug=os.getenv('FLASK_DEBUG', 'False').lower() in ('1', 'true'), host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -48,7 +48,20 @@ export const resetSessionTokens = async () => {
 
 export const generateReplicas = async (data) => {
   const response = await api.post('/generate-replicas', data);
-  return response.data;
+  const result = response.data;
+
+  // Metadata shared by all replicas (subtopic, course, module, unit) is sent once as `meta`;
+  // copy it onto each generated replica so display and downloads see complete records
+  if (result?.meta && result.replicas) {
+    Object.keys(result.replicas).forEach(key => {
+      const replica = result.replicas[key];
+      if (replica && !replica.error) {
+        result.replicas[key] = { ...replica, ...result.meta };
+      }
+    });
+  }
+
+  return result;
 };
 
 export const downloadExcel = async (replicas) => {